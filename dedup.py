@@ -0,0 +1,162 @@
+import argparse
+
+import numpy as np
+
+from gamesdb import DataBase, same_metadata
+
+# Odd multipliers mixing the move ids of an n-gram into one 64-bit value.
+_NGRAM_MULTIPLIERS = np.array([0x9e3779b97f4a7c15, 0xc2b2ae3d27d4eb4f,
+                               0x165667b19e3779f9, 0xd6e8feb86659fd93,
+                               0xff51afd7ed558ccd, 0xc4ceb9fe1a85ec53],
+                              dtype=np.uint64)
+
+
+class MinHasher(object):
+    """MinHash signatures of the n-grams of move sequences.
+
+    The fraction of equal components of two signatures estimates the Jaccard
+    similarity of the sets of n-grams of the games.
+    """
+
+    def __init__(self, num_perm=64, ngram=4, seed=1):
+        if not 1 <= ngram <= len(_NGRAM_MULTIPLIERS):
+            raise ValueError('Unsupported n-gram size: {}'.format(ngram))
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self._ngram = ngram
+        # Multiply-shift hash functions (a * x + b) >> 32 with odd a.
+        self._a = (rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64) *
+                   np.uint64(2) + np.uint64(1))[:, np.newaxis]
+        self._b = rng.integers(0, 1 << 63, size=num_perm,
+                               dtype=np.uint64)[:, np.newaxis]
+        self._move_ids = {}
+
+    def signature(self, moves):
+        """Return the signature of a list of moves, or None if it is short."""
+        n = len(moves) - self._ngram + 1
+        if n < 1:
+            return None
+        move_ids = self._move_ids
+        try:
+            ids = np.fromiter(map(move_ids.__getitem__, moves),
+                              dtype=np.uint64, count=len(moves))
+        except KeyError:
+            for move in moves:
+                move_ids.setdefault(move, len(move_ids) + 1)
+            ids = np.fromiter(map(move_ids.__getitem__, moves),
+                              dtype=np.uint64, count=len(moves))
+        ngrams = np.zeros(n, dtype=np.uint64)
+        for i in range(self._ngram):
+            ngrams += ids[i:i + n] * _NGRAM_MULTIPLIERS[i]
+        hashes = (self._a * ngrams + self._b) >> np.uint64(32)
+        return hashes.min(axis=1).astype(np.uint32)
+
+
+def _band_candidates(signatures, bands, max_bucket):
+    """Yield the pairs of rows with an equal band of the signatures."""
+    rows = signatures.shape[1] // bands
+    for band in range(bands):
+        keys = np.zeros(len(signatures), dtype=np.uint64)
+        for column in signatures[:, band * rows:(band + 1) * rows].T:
+            keys = keys * np.uint64(0x100000001b3) + column
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(
+            np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        sizes = np.diff(np.r_[starts, len(keys)])
+        for start, size in zip(starts[sizes > 1], sizes[sizes > 1]):
+            # Huge buckets are common short sequences, not duplicates.
+            if size > max_bucket:
+                continue
+            bucket = np.sort(order[start:start + size])
+            for i in range(size):
+                for j in range(i + 1, size):
+                    yield bucket[i], bucket[j]
+
+
+def find_near_duplicates(db, threshold=0.7, num_perm=64, bands=16, ngram=4,
+                         min_moves=20, max_bucket=100):
+    """Find the games that are duplicates with slightly different moves.
+
+    Candidate pairs are found with locality-sensitive hashing of the MinHash
+    signatures of the move n-grams: two games are candidates if all the rows
+    of one of the bands of their signatures are equal. A candidate is
+    confirmed if the estimated Jaccard similarity of the n-grams is at least
+    threshold and the metadata agrees as in DataBase.find_game. The time is
+    linear in the number of games, apart from sorting and the candidates.
+
+    Games with fewer than min_moves half-moves are ignored.
+
+    Returns a list of (gameid1, gameid2, similarity) with gameid1 < gameid2.
+    """
+    hasher = MinHasher(num_perm, ngram)
+    gameids = []
+    signatures = []
+    for gameid, moves in db.iterate_moves():
+        if len(moves) < min_moves:
+            continue
+        gameids.append(gameid)
+        signatures.append(hasher.signature(moves))
+    if not gameids:
+        return []
+    signatures = np.vstack(signatures)
+
+    duplicates = []
+    seen = set()
+    games = {}
+    for i, j in _band_candidates(signatures, bands, max_bucket):
+        if (i, j) in seen:
+            continue
+        seen.add((i, j))
+        equal = np.count_nonzero(signatures[i] == signatures[j])
+        similarity = equal / num_perm
+        if similarity < threshold:
+            continue
+        for k in (i, j):
+            if gameids[k] not in games:
+                games[gameids[k]] = db.load_game(gameids[k], tags=False)
+        if same_metadata(games[gameids[i]], games[gameids[j]]):
+            duplicates.append((gameids[i], gameids[j], similarity))
+    duplicates.sort()
+    return duplicates
+
+
+def main(args):
+    db = DataBase(args.games)
+    duplicates = find_near_duplicates(db, threshold=args.threshold)
+
+    removed = set()
+    for gameid1, gameid2, similarity in duplicates:
+        game1 = db.load_game(gameid1, tags=False)
+        game2 = db.load_game(gameid2, tags=False)
+        print('{:.2f}'.format(similarity))
+        print(game1)
+        print(game2)
+        print()
+        if gameid1 not in removed and gameid2 not in removed:
+            # Keep the game with more moves, the other one is truncated.
+            if len(game1.moves) >= len(game2.moves):
+                removed.add(gameid2)
+            else:
+                removed.add(gameid1)
+
+    print('{} near-duplicate pairs found.'.format(len(duplicates)))
+    if args.delete:
+        db.delete_games(removed)
+        db.commit()
+        print('{} games deleted.'.format(len(removed)))
+
+
+def parse_command_line():
+    parser = argparse.ArgumentParser(description='Find near-duplicate games.')
+
+    parser.add_argument('-g', '--games', default='games.db')
+    parser.add_argument('-t', '--threshold', type=float, default=0.7,
+                        help='minimal estimated similarity of the moves')
+    parser.add_argument('--delete', action='store_true',
+                        help='delete the shorter game of each pair')
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    main(parse_command_line())
@@ -1,6 +1,22 @@
+import bz2
 import calendar
+import collections
+import contextlib
 import datetime
+import functools
+import gzip
+import hashlib
+import io
+import lzma
+import mmap
+import multiprocessing
+import os.path
+import queue
 import re
+import sys
+import threading
+import time
+import zipfile
 
 class PGNSyntaxError(Exception):
     pass
@@ -9,6 +25,7 @@ _DATE = re.compile(r'(\d\d\d\d|\?+)[\-\.](\d\d|\?+)[\-\.](\d\d|\?+)')
 _RESULT_STR = ('0-1', '1-0', '1/2-1/2')
 
 
+@functools.lru_cache(maxsize=1 << 16)
 def _parse_date(date_str):
     date_match = _DATE.match(date_str)
     precision = 0
@@ -35,6 +52,12 @@ def _parse_date(date_str):
     return date, precision
 
 
+def moves_hash(moves_str):
+    """64-bit signed hash of a move sequence, stable across processes."""
+    digest = hashlib.blake2b(moves_str.encode('utf-8'), digest_size=8)
+    return int.from_bytes(digest.digest(), 'little', signed=True)
+
+
 def lastname_from_name(name):
     i = name.find(',')
     if i >= 0:
@@ -44,11 +67,14 @@ def lastname_from_name(name):
 
 
 class Game(object):
+    __slots__ = ('result', 'player1_name', 'player2_name',
+                 'player1_id', 'player2_id', 'date', 'date_precision',
+                 '_moves', '_movetext', 'gameid', 'tags')
 
     def __init__(self, result, player1_name, player2_name,
                  player1_id=None, player2_id=None, date=None,
                  date_precision=0, moves=None, gameid=None,
-                 tags=None):
+                 tags=None, movetext=None):
         self.result = result
         self.player1_name = player1_name
         self.player2_name = player2_name
@@ -59,19 +85,38 @@ class Game(object):
         else:
             self.date = date
             self.date_precision = date_precision
-        self.moves = moves
+        self._moves = moves
+        # Movetext to extract the moves from on the first access.
+        self._movetext = movetext
         self.gameid = gameid
         if tags:
             self.tags = tags
         else:
             self.tags = {}
 
+    @property
+    def moves(self):
+        if self._movetext is not None:
+            movetext = self._movetext
+            if isinstance(movetext, bytes):
+                movetext = _COMMENT_BYTES.sub(b' ', movetext).decode(
+                    'iso-8859-1')
+            self._moves = _extract_moves(movetext)
+            self._movetext = None
+        return self._moves
+
+    @moves.setter
+    def moves(self, moves):
+        self._moves = moves
+        self._movetext = None
+
     @staticmethod
-    def fromtags(tags, moves):
+    def fromtags(tags, moves=None, movetext=None):
         date, precision = _parse_date(tags['Date'])
 
-        player1_name = tags['White']
-        player2_name = tags['Black']
+        # Player names repeat a lot in a dump, keep one copy of each.
+        player1_name = tags['White'] = sys.intern(tags['White'])
+        player2_name = tags['Black'] = sys.intern(tags['Black'])
 
         if tags['Result'] == '1-0':
             result = 1
@@ -86,7 +131,8 @@ class Game(object):
                     date=date,
                     date_precision=precision,
                     moves=moves,
-                    tags=tags)
+                    tags=tags,
+                    movetext=movetext)
 
     def __str__(self):
         game_str = '{} {}-{} {} ({} moves)'.format(
@@ -94,7 +140,7 @@ class Game(object):
             self.player1_name,
             self.player2_name,
             self.date_str(),
-            len(self.moves) / 2)
+            '?' if self.moves is None else len(self.moves) / 2)
         if self.gameid:
             return '#{}: '.format(self.gameid) + game_str
         else:
@@ -117,6 +163,9 @@ class Game(object):
     def moves_str(self):
         return ' '.join(self.moves)
 
+    def moves_hash(self):
+        return moves_hash(self.moves_str())
+
     def add_tag(self, name, value):
         self.tags[name] = value
 
@@ -128,15 +177,71 @@ class Game(object):
 
 
 
+def _strip_comments(line, in_comment):
+    """Remove the comments from a line of PGN.
+
+    Returns the stripped line and whether a brace comment is still open at the
+    end of the line.
+    """
+    tail = line.strip()
+    output = ''
+    while len(tail):
+        if in_comment:
+            p = tail.find('}')
+            if p == -1:
+                tail = ''
+            else:
+                tail = tail[p+1:]
+                in_comment = False
+        else:
+            semicolon = tail.find(';')
+            brace = tail.find('{')
+
+            if semicolon > -1 and (semicolon < brace or brace == -1):
+                output += tail[:semicolon]
+                tail = ''
+            elif brace > -1 and (brace < semicolon or semicolon == -1):
+                output += tail[:brace] + ' '
+                tail = tail[brace+1:]
+                in_comment = True
+            else:
+                output += tail
+                tail = ''
+
+    return output.rstrip(), in_comment
+
+
 _TAG_LINE = re.compile(r'\s*\[(\w+)\s+"(.*)"\]\s*')
-_SPLIT_MOVES = re.compile(r'([()]|\s+)')
-_MOVE = re.compile(
-    r'^(O-O(?:-O)?|[PNBRQK]?[a-h]?[1-8]?x?[a-h][1-8])(?:$|[^a-z].*)')
+# Tokens of the movetext, separated by whitespace and parentheses. Group 1
+# and 2 are the parentheses of a variation, group 3 is a move, group 4 is a
+# token starting with a letter, which is not a move. Comments, move numbers,
+# NAGs and results match without any group.
+_MOVETEXT_TOKEN = re.compile(r"""
+    \{[^}]*\}? | ;[^\n]*
+  | (\() | (\))
+  | (?:P(?=[a-h1-8x]))?
+    (O-O(?:-O)?|[NBRQK]?[a-h]?[1-8]?x?[a-h][1-8])(?![a-z])[^\s()]*
+  | ([^\W\d_])[^\s()]*
+  | [^\s()]+
+""", re.X)
 
 class PGNParser(object):
-
-    def __init__(self, file):
+    """Parser of PGN files.
+
+    Args:
+        file: text file object.
+        moves: what to do with the movetext of the games:
+            'parse' -- extract the list of moves,
+            'lazy' -- keep the movetext, the moves are extracted on the first
+                access to Game.moves,
+            'skip' -- ignore the movetext, Game.moves is None.
+    """
+
+    def __init__(self, file, moves='parse'):
+        if moves not in ('parse', 'lazy', 'skip'):
+            raise ValueError('Unknown moves mode: {}'.format(moves))
         self._file = file
+        self._moves = moves
         self._current_line = None
         self._in_comment = False
 
@@ -144,8 +249,8 @@ class PGNParser(object):
         while not self._eof():
             try:
                 tags = self._parse_tags()
-                moves = self._parse_moves()
-                game = Game.fromtags(tags, moves)
+                movetext = self._parse_moves()
+                game = self._make_game(tags, movetext)
             except Exception:
                 continue
             yield game
@@ -153,6 +258,13 @@ class PGNParser(object):
     def parse_all(self):
         return list(self.parse())
 
+    def _make_game(self, tags, movetext):
+        if self._moves == 'parse':
+            return Game.fromtags(tags, moves=_extract_moves(movetext))
+        if self._moves == 'lazy':
+            return Game.fromtags(tags, movetext=movetext)
+        return Game.fromtags(tags)
+
     def _read_line_wo_comments(self):
         line = self._file.readline()
         if line == '':
@@ -160,32 +272,8 @@ class PGNParser(object):
         if line[0] == '%':
             return ''
 
-        tail = line.strip()
-        output = ''
-        while len(tail):
-            if self._in_comment:
-                p = tail.find('}')
-                if p == -1:
-                    tail = ''
-                else:
-                    tail = tail[p+1:]
-                    self._in_comment = False
-            else:
-                semicolon = tail.find(';')
-                brace = tail.find('{')
-
-                if semicolon > -1 and (semicolon < brace or brace == -1):
-                    output += tail[:semicolon]
-                    tail = ''
-                elif brace > -1 and (brace < semicolon or semicolon == -1):
-                    output += tail[:brace] + ' '
-                    tail = tail[brace+1:]
-                    self._in_comment = True
-                else:
-                    output += tail
-                    tail = ''
-
-        return output.rstrip()
+        output, self._in_comment = _strip_comments(line, self._in_comment)
+        return output
 
     def _next_line(self):
         if self._current_line is not None:
@@ -224,12 +312,13 @@ class PGNParser(object):
             if name in tags:
                 raise PGNSyntaxError('Duplicate tag.')
             value = re.sub(r'\\([\\"])', r'\1', value)
-            tags[name] = value
+            tags[sys.intern(name)] = value
 
         return tags
 
     def _parse_moves(self):
-        moves_str = ''
+        """Read the movetext of a game, return it without comments."""
+        lines = []
         while not self._eof():
             line = self._next_line()
             if line == '':
@@ -237,27 +326,493 @@ class PGNParser(object):
             if line[0] == '[':
                 self._push_back_line(line)
                 break
-            moves_str += ' ' + line
+            if self._moves != 'skip':
+                lines.append(line)
+
+        return ' '.join(lines)
+
 
-        return self._extract_moves(moves_str)
+# Move for each distinct token seen outside of variations: '' if the token is
+# not a move, None if it's a wrong token.
+_TOKEN_MOVES = {}
 
-    def _extract_moves(self, moves_str):
-        moves = []
-        nested = 0
-        for substr in _SPLIT_MOVES.split(moves_str):
-            if substr.strip() == '':
+
+def _token_move(token):
+    match = _MOVETEXT_TOKEN.match(token)
+    if match.group(3):
+        return sys.intern(match.group(3))
+    if match.group(4):
+        return None
+    return ''
+
+
+def _extract_moves(moves_str):
+    """Return the moves of the main line in the movetext."""
+    if any(c in moves_str for c in '(){;'):
+        return _extract_moves_with_variations(moves_str)
+
+    tokens = moves_str.split()
+    try:
+        moves = [_TOKEN_MOVES[token] for token in tokens]
+    except KeyError:
+        if len(_TOKEN_MOVES) > 1 << 16:
+            _TOKEN_MOVES.clear()
+        for token in tokens:
+            if token not in _TOKEN_MOVES:
+                _TOKEN_MOVES[token] = _token_move(token)
+        moves = [_TOKEN_MOVES[token] for token in tokens]
+    if None in moves:
+        raise PGNSyntaxError('Wrong move.')
+    return list(filter(None, moves))
+
+
+def _extract_moves_with_variations(moves_str):
+    """Return the moves of the main line, skipping variations and comments."""
+    moves = []
+    nested = 0
+    for open_paren, close_paren, move, other in _MOVETEXT_TOKEN.findall(
+            moves_str):
+        if move:
+            if nested == 0:
+                moves.append(sys.intern(move))
+        elif open_paren:
+            nested += 1
+        elif close_paren:
+            nested -= 1
+        elif other and nested == 0:
+            raise PGNSyntaxError('Wrong move.')
+    return moves
+
+
+# Well-formed tag lines of a block without comments and escapes.
+_TAG_LINE_STR = re.compile(r'^\[(\w+)[^\S\n]+"(.*)"\]', re.M)
+_TAG_BLOCK_BYTES = re.compile(rb'(?:[ \t]*\[[^\n]*\n)*')
+_SKIP_BYTES = re.compile(rb'(?:\s+|^%[^\n]*)*', re.M)
+# Matches comments and escape lines, so that a '[' inside them is never taken
+# for the beginning of the next game. Group 1 is set only on a tag line.
+_MOVETEXT_TOKEN_BYTES = re.compile(
+    rb'\{[^}]*\}?|;[^\n]*|^%[^\n]*|^[ \t]*(\[)', re.M)
+_INDENTED_TAG_BYTES = re.compile(rb'\n[ \t]+\[')
+_COMMENT_BYTES = re.compile(rb'\{[^}]*\}?|;[^\n]*|^%[^\n]*', re.M)
+
+
+@contextlib.contextmanager
+def map_file(file):
+    """Map the contents of a file opened in binary mode into memory."""
+    try:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        # Empty files can't be mapped.
+        yield b''
+        return
+    with data:
+        yield data
+
+
+class MappedPGNParser(PGNParser):
+    """PGN parser working on raw bytes, e.g. on a memory-mapped file.
+
+    Game boundaries and tag lines are found on the undecoded buffer, only the
+    tag blocks and the movetext of each game are decoded. Produces the same
+    games as PGNParser.
+
+    Args:
+        data: bytes-like object or mmap with the contents of a PGN file.
+        start, end: byte range of the buffer to parse. start should point to
+            the beginning of a line.
+        encoding: encoding of the file.
+        moves: 'parse', 'lazy' or 'skip', see PGNParser. In the lazy mode the
+            games keep the raw bytes of the movetext.
+    """
+
+    def __init__(self, data, start=0, end=None, encoding='iso-8859-1',
+                 moves='parse'):
+        if moves not in ('parse', 'lazy', 'skip'):
+            raise ValueError('Unknown moves mode: {}'.format(moves))
+        self._moves = moves
+        self._data = data
+        self._pos = start
+        self._end = len(data) if end is None else end
+        self._encoding = encoding
+
+    def parse(self):
+        for game, _ in self.parse_with_offsets():
+            yield game
+
+    def parse_with_offsets(self):
+        """Yield (game, offset) pairs.
+
+        offset is the position just after the game, where the parsing can be
+        restarted with the same result.
+        """
+        for tags, movetext in self._scan_games():
+            try:
+                game = self._make_game(tags, movetext)
+            except Exception:
                 continue
-            if substr == '(':
-                nested += 1
-            elif substr == ')':
-                nested -= 1
-            elif nested == 0 and substr[0].isalpha():
-                moves.append(self._strip_move(substr))
-        return moves
-
-    def _strip_move(self, move_str):
-        match = _MOVE.match(move_str)
-        move = match.group(1)
-        if move[0] == 'P':
-            move = move[1:]
-        return move
+            yield game, self._offset()
+
+    def _offset(self):
+        return self._pos
+
+    def _scan_games(self):
+        """Yield the tags and the movetext of each game.
+
+        After each game self._pos points to the end of its movetext, where
+        the parsing can be restarted with the same result.
+        """
+        while True:
+            self._pos = _SKIP_BYTES.match(
+                self._data, self._pos, self._end).end()
+            if self._pos >= self._end:
+                break
+            try:
+                tags = self._scan_tags()
+            except PGNSyntaxError:
+                continue
+            yield tags, self._scan_movetext()
+
+    def _scan_tags(self):
+        data = self._data
+        start = self._pos
+        end = _TAG_BLOCK_BYTES.match(data, start, self._end).end()
+        next_pos = _SKIP_BYTES.match(data, end, self._end).end()
+
+        # Fast path: a block of tag lines without comments, followed by the
+        # movetext, is decoded at once.
+        if ((next_pos >= self._end or data[next_pos] != ord('[')) and
+                data.find(b'{', start, end) == -1 and
+                data.find(b';', start, end) == -1):
+            block = data[start:end].decode(self._encoding)
+            tags = {sys.intern(name): value
+                    for name, value in _TAG_LINE_STR.findall(block)}
+            if len(tags) == block.count('\n'):
+                if '\\' in block:
+                    for name, value in tags.items():
+                        tags[name] = re.sub(r'\\([\\"])', r'\1', value)
+                self._pos = next_pos
+                return tags
+
+        return self._scan_tags_by_line()
+
+    def _scan_tags_by_line(self):
+        """Parse the tags line by line the same way as PGNParser does."""
+        data = self._data
+        end = self._end
+        pos = self._pos
+        in_comment = False
+        tags = {}
+        while pos < end:
+            next_pos = data.find(b'\n', pos, end) + 1 or end
+            if data[pos] == ord('%'):
+                pos = next_pos
+                continue
+            line, line_in_comment = _strip_comments(
+                data[pos:next_pos].decode(self._encoding), in_comment)
+            if len(line) == 0:
+                pos, in_comment = next_pos, line_in_comment
+                continue
+            if line[0] != '[':
+                break
+            match = _TAG_LINE.match(line)
+            if not match:
+                self._pos = next_pos
+                raise PGNSyntaxError('Wrong tag line.')
+            name, value = match.groups()
+            if name in tags:
+                self._pos = pos
+                raise PGNSyntaxError('Duplicate tag.')
+            value = re.sub(r'\\([\\"])', r'\1', value)
+            tags[sys.intern(name)] = value
+            pos, in_comment = next_pos, line_in_comment
+
+        if in_comment:
+            # The movetext starts after the end of a comment opened in the tags.
+            pos = data.find(b'}', pos, end) + 1 or end
+        self._pos = pos
+        return tags
+
+    def _scan_movetext(self):
+        """Find the end of the movetext and return it.
+
+        The movetext is returned decoded and without comments, as raw bytes in
+        the lazy mode or not at all in the skip mode.
+        """
+        data = self._data
+        start = self._pos
+        end = self._end
+
+        # Fast path: the next line starting with '[' ends the movetext unless
+        # there is a comment or an indented tag line before it.
+        pos = data.find(b'\n[', start, end)
+        if pos == -1:
+            pos = end
+        else:
+            pos += 1
+        comments = (data.find(b'{', start, pos) != -1 or
+                    data.find(b';', start, pos) != -1 or
+                    data.find(b'%', start, pos) != -1)
+        if comments or _INDENTED_TAG_BYTES.search(data, start, pos):
+            pos = start
+            while True:
+                match = _MOVETEXT_TOKEN_BYTES.search(data, pos, end)
+                if not match:
+                    pos = end
+                    break
+                if match.group(1) is not None:
+                    pos = match.start()
+                    break
+                pos = match.end()
+        self._pos = pos
+
+        if self._moves == 'skip':
+            return None
+        movetext = data[start:pos]
+        if self._moves == 'lazy':
+            return movetext
+        if comments:
+            movetext = _COMMENT_BYTES.sub(b' ', movetext)
+        return movetext.decode(self._encoding)
+
+
+class StreamPGNParser(MappedPGNParser):
+    """PGN parser reading a binary stream in chunks.
+
+    Each chunk is scanned the same way as by MappedPGNParser. The last game
+    found in the buffer is parsed again together with the next chunk, so the
+    games are exactly the same as if the whole stream was parsed at once.
+
+    Args:
+        file: binary file object, e.g. returned by open_pgn.
+        chunk_size: number of bytes to read at once.
+        encoding, moves: see MappedPGNParser.
+        offset: position of the file in the stream, the offsets returned by
+            parse_with_offsets start from it.
+    """
+
+    def __init__(self, file, chunk_size=1 << 20, encoding='iso-8859-1',
+                 moves='parse', offset=0):
+        super().__init__(b'', encoding=encoding, moves=moves)
+        self._file = file
+        self._chunk_size = chunk_size
+        self._base = offset
+        self._game_offset = offset
+
+    def _offset(self):
+        return self._game_offset
+
+    def _scan_games(self):
+        data = b''
+        base = self._base
+        eof = False
+        while not eof:
+            # Reading at least as much as is left over keeps the rescanning
+            # linear when a game is longer than a chunk.
+            chunk = self._file.read(max(self._chunk_size, len(data)))
+            eof = not chunk
+            data += chunk
+            self._data, self._pos, self._end = data, 0, len(data)
+
+            # The position where the scan of the last game started.
+            last_start = 0
+            start = 0
+            last = None
+            for game in super()._scan_games():
+                if last is not None:
+                    self._game_offset = base + last_end
+                    yield last
+                last, last_start, last_end = game, start, self._pos
+                start = self._pos
+
+            if eof and last is not None:
+                self._game_offset = base + last_end
+                yield last
+            data = data[last_start:]
+            base += last_start
+
+
+class _ReadaheadReader(io.RawIOBase):
+    """Raw stream of chunks produced by a background thread.
+
+    At most max_chunks chunks are buffered.
+    """
+
+    def __init__(self, chunks, max_chunks=8):
+        self._queue = queue.Queue(max_chunks)
+        self._closing = threading.Event()
+        self._chunk = b''
+        self._offset = 0
+        self._eof = False
+        self._thread = threading.Thread(target=self._produce, args=(chunks,),
+                                        daemon=True)
+        self._thread.start()
+
+    def _produce(self, chunks):
+        try:
+            for chunk in chunks:
+                if not self._put(chunk):
+                    break
+            else:
+                self._put(None)
+        except Exception as error:
+            self._put(error)
+        finally:
+            chunks.close()
+
+    def _put(self, item):
+        while not self._closing.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self._offset == len(self._chunk):
+            if self._eof:
+                return 0
+            item = self._queue.get()
+            if item is None:
+                self._eof = True
+                return 0
+            if isinstance(item, Exception):
+                self._eof = True
+                raise item
+            self._chunk, self._offset = item, 0
+
+        n = min(len(buffer), len(self._chunk) - self._offset)
+        buffer[:n] = self._chunk[self._offset:self._offset + n]
+        self._offset += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._closing.set()
+            self._thread.join()
+        super().close()
+
+
+_OPENERS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+
+
+def _timed_chunks(chunks, progress):
+    with contextlib.closing(chunks):
+        while True:
+            start = time.monotonic()
+            chunk = next(chunks, None)
+            if chunk is None:
+                return
+            progress(len(chunk), time.monotonic() - start)
+            yield chunk
+
+
+def _read_chunks(filename, chunk_size, offset=0):
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.zip':
+        with zipfile.ZipFile(filename) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                # Every member is followed by a newline.
+                if offset > info.file_size:
+                    offset -= info.file_size + 1
+                    continue
+                with archive.open(info) as member:
+                    member.seek(offset)
+                    offset = 0
+                    yield from iter(lambda: member.read(chunk_size), b'')
+                # Keep the last game of a member apart from the next one.
+                yield b'\n'
+    else:
+        with _OPENERS.get(ext, open)(filename, 'rb') as pgn_file:
+            pgn_file.seek(offset)
+            yield from iter(lambda: pgn_file.read(chunk_size), b'')
+
+
+def is_compressed(filename):
+    ext = os.path.splitext(filename)[1].lower()
+    return ext == '.zip' or ext in _OPENERS
+
+
+def open_pgn(filename, encoding=None, chunk_size=1 << 20, progress=None,
+             offset=0):
+    """Open a PGN file, which may be compressed with gzip, bzip2, xz or zip.
+
+    The file is read and decompressed in a background thread, a few chunks
+    ahead of the reader. All the members of a zip archive are read one after
+    another.
+
+    If progress is given, it is called from the background thread with the
+    size of every chunk and the number of seconds spent reading it.
+
+    The reading starts at the given offset of the decompressed stream. For
+    compressed files everything before it is decompressed and dropped.
+
+    Returns a binary file object, or a text one if encoding is given.
+    """
+    chunks = _read_chunks(filename, chunk_size, offset)
+    if progress is not None:
+        chunks = _timed_chunks(chunks, progress)
+    reader = io.BufferedReader(_ReadaheadReader(chunks), chunk_size)
+    if encoding is None:
+        return reader
+    return io.TextIOWrapper(reader, encoding=encoding)
+
+
+def split_pgn(data, range_size, start=0):
+    """Split a PGN buffer into byte ranges of at least range_size bytes.
+
+    Yields (start, end) tuples covering the buffer from start on. The ranges
+    are found by scanning the tags and the movetext with MappedPGNParser, so
+    parsing the ranges one by one gives exactly the same games as parsing the
+    whole buffer, even if a comment swallows several games.
+    """
+    parser = MappedPGNParser(data, start, moves='skip')
+    for _ in parser._scan_games():
+        if parser._pos - start >= range_size and parser._pos < len(data):
+            yield start, parser._pos
+            start = parser._pos
+    yield start, len(data)
+
+
+def _parse_file_range(args):
+    filename, start, end, moves, offsets = args
+    with open(filename, 'rb') as pgn_file, map_file(pgn_file) as data:
+        parser = MappedPGNParser(data, start, end, moves=moves)
+        if offsets:
+            return list(parser.parse_with_offsets())
+        return parser.parse_all()
+
+
+def parse_file_parallel(filename, processes=None, range_size=1 << 24,
+                        moves='parse', start=0, offsets=False):
+    """Parse a PGN file in a pool of worker processes.
+
+    The file is split into ranges of about range_size bytes, which are parsed
+    by the workers. The games are yielded in the order of the file, the same
+    as MappedPGNParser would yield them. At most two ranges per worker are
+    parsed ahead.
+
+    The parsing starts at the start offset. If offsets is true, (game, offset)
+    pairs are yielded, as by MappedPGNParser.parse_with_offsets.
+    """
+    processes = processes or multiprocessing.cpu_count()
+    with multiprocessing.Pool(processes) as pool, \
+            open(filename, 'rb') as pgn_file, map_file(pgn_file) as data:
+        pending = collections.deque()
+        for range_start, range_end in split_pgn(data, range_size, start):
+            args = (filename, range_start, range_end, moves, offsets)
+            pending.append(pool.apply_async(_parse_file_range, (args,)))
+            if len(pending) >= 2 * processes:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
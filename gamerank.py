@@ -5,11 +5,14 @@ import pstats
 
 from gamesdb import DataBase
 from optimizer import Optimizer
+from resultcache import ResultCache
 
 def main(args, profile=False):
-    db = DataBase(args.games)
-    results = db.load_game_results(mingames=50)
-    print('{} games loaded.'.format(len(results)))
+    # Doesn't wait for an import into a WAL database.
+    db = DataBase(args.games, read_only=True)
+    # Only the games added since the last run are read from the database.
+    results = ResultCache(db).load(mingames=50)
+    print('{} games loaded.'.format(len(results.day)))
     players = db.load_players()
     optimizer = Optimizer(disp=True)
     optimizer.load_games(results)
@@ -18,6 +21,10 @@ def main(args, profile=False):
 
     if profile:
         return
+    # A connection that can write, only for the end of a long run.
+    runid = DataBase(args.games).save_ratings(
+        ratings, description='gamerank mingames=50')
+    print('Ratings saved as run {}.'.format(runid))
     print()
 
     by_rating = []
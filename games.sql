@@ -1,4 +1,4 @@
-CREATE TABLE game (
+CREATE TABLE IF NOT EXISTS game (
   gameid INTEGER PRIMARY KEY AUTOINCREMENT,
   playerid1 INTEGER,
   playerid2 INTEGER,
@@ -7,24 +7,103 @@ CREATE TABLE game (
   dateprecision INTEGER,
   nmoves INTEGER,
   moves TEXT,
+  packedmoves BLOB,
+  openingkey TEXT,
+  moveshash INTEGER,
   FOREIGN KEY (playerid1) REFERENCES player(playerid),
   FOREIGN KEY (playerid2) REFERENCES player(playerid)
 );
 
-CREATE INDEX game_moves ON game (moves);
+CREATE INDEX IF NOT EXISTS game_moveshash ON game (moveshash);
 
-CREATE TABLE player (
+-- Covering indices of the games of a player, see DataBase.player_games.
+CREATE INDEX IF NOT EXISTS game_player1_date
+  ON game (playerid1, date, playerid2, result, dateprecision);
+CREATE INDEX IF NOT EXISTS game_player2_date
+  ON game (playerid2, date, playerid1, result, dateprecision);
+
+CREATE TABLE IF NOT EXISTS player (
   playerid INTEGER PRIMARY KEY AUTOINCREMENT,
   name TEXT,
   firstnames TEXT,
   lastname TEXT
 );
 
-CREATE INDEX player_name ON player (name);
+CREATE INDEX IF NOT EXISTS player_name ON player (name);
 
-CREATE TABLE tag (
+CREATE TABLE IF NOT EXISTS tag (
   gameid INTEGER,
-  name TEXT,
+  tagnameid INTEGER,
   value TEXT,
-  FOREIGN KEY (gameid) REFERENCES game(gameid)
+  FOREIGN KEY (gameid) REFERENCES game(gameid),
+  FOREIGN KEY (tagnameid) REFERENCES tagname(tagnameid)
+);
+
+CREATE INDEX IF NOT EXISTS tag_gameid ON tag (gameid);
+-- The games with a tag value, see gamesdb.tag_filter.
+CREATE INDEX IF NOT EXISTS tag_name_value ON tag (tagnameid, value, gameid);
+
+CREATE TABLE IF NOT EXISTS tagname (
+  tagnameid INTEGER PRIMARY KEY,
+  name TEXT UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS checkpoint (
+  fingerprint TEXT PRIMARY KEY,
+  filename TEXT,
+  position INTEGER,
+  ngames INTEGER,
+  complete INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS move (
+  moveid INTEGER PRIMARY KEY,
+  san TEXT
+);
+
+CREATE TABLE IF NOT EXISTS opening (
+  prefix TEXT PRIMARY KEY,
+  ngames INTEGER
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS shard (
+  shardid INTEGER PRIMARY KEY,
+  path TEXT,
+  startdate INTEGER,
+  enddate INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS ratingrun (
+  runid INTEGER PRIMARY KEY AUTOINCREMENT,
+  created INTEGER,
+  description TEXT
+);
+
+-- The ratings of a player between date and nextdate are interpolated
+-- linearly from rating to nextrating. The last rating of a player has
+-- nextdate in the far future and nextrating equal to rating.
+CREATE TABLE IF NOT EXISTS rating (
+  runid INTEGER,
+  playerid INTEGER,
+  date INTEGER,
+  rating REAL,
+  nextdate INTEGER,
+  nextrating REAL,
+  PRIMARY KEY (runid, playerid, date),
+  FOREIGN KEY (runid) REFERENCES ratingrun(runid),
+  FOREIGN KEY (playerid) REFERENCES player(playerid)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS rating_date
+  ON rating (runid, date, nextdate, playerid, rating, nextrating);
+
+CREATE TABLE IF NOT EXISTS property (
+  name TEXT PRIMARY KEY,
+  value
 );
+
+-- Identifies the database and counts the changes other than adding games,
+-- see DataBase.games_fingerprint.
+INSERT OR IGNORE INTO property(name, value)
+  VALUES ('uuid', lower(hex(randomblob(16))));
+INSERT OR IGNORE INTO property(name, value) VALUES ('generation', 0);
@@ -1,12 +1,32 @@
+import collections
+import contextlib
 import datetime
+import itertools
 import math
 import os.path
+import pathlib
+import queue
 import sqlite3
+import threading
 
-from game import Game, lastname_from_name
+import numpy as np
+
+from game import Game, lastname_from_name, moves_hash
+from movecodec import MoveCodec
 
 YEAR = 365 * 24 * 3600
 
+# Number of half-moves of the games in the opening tree.
+OPENING_DEPTH = 20
+
+
+def _opening_key(moves):
+    """Key of a move sequence, the keys of its prefixes are string prefixes.
+
+    The games with a given prefix have keys in [key, key[:-1] + '!').
+    """
+    return ' ' + ''.join(move + ' ' for move in moves)
+
 
 def _dates_compatible(date1, date1_precision, date2, date2_precision):
     d1 = datetime.date.fromtimestamp(date1)
@@ -26,35 +46,579 @@ def _dates_compatible(date1, date1_precision, date2, date2_precision):
     return True
 
 
+def _same_metadata(game, result, date, date_precision, player1, player2):
+    return (result == game.result and
+            _dates_compatible(game.date, game.date_precision,
+                              date, date_precision) and
+            lastname_from_name(player1) == game.player1_lastname() and
+            lastname_from_name(player2) == game.player2_lastname())
+
+
+def same_metadata(game1, game2):
+    """Whether the results, the dates and the last names of games agree."""
+    return _same_metadata(game1, game2.result, game2.date,
+                          game2.date_precision, game2.player1_name,
+                          game2.player2_name)
+
+
+def _match_game(game, rows, describe):
+    """Find the game among the rows of the games with the same moves.
+
+    The rows are (key, result, date, dateprecision, player1, player2) tuples.
+    Returns the key of the matching row, or None. Raises DuplicateGameError
+    if a game with the same moves has different metadata, describe(key) is
+    used in the message.
+    """
+    for row in rows:
+        if _same_metadata(game, *row[1:]):
+            return row[0]
+        elif (len(game.moves) >= 19 and
+            _dates_compatible(game.date, game.date_precision,
+                              row[2], row[3])):
+            raise DuplicateGameError(
+                'Two games with the same moves, but ' +
+                'different metadata:\n' +
+                'DB: ' + describe(row[0]) + '\n' +
+                'New: ' + str(game))
+    return None
+
+
+# Columns of the game and tag tables, in the views over the shards.
+_GAME_COLUMNS = ('gameid, playerid1, playerid2, result, date, dateprecision, '
+                 'nmoves, moves, packedmoves, openingkey, moveshash')
+_TAG_COLUMNS = 'rowid AS tagrowid, gameid, tagnameid, value'
+
+# The game ids of a shard start at its shardid times this.
+_SHARD_GAMEIDS = 1 << 40
+
+# nextdate of the last rating of a player.
+_LAST_RATING_DATE = 1 << 62
+
+# Rating of a player at a date, interpolated in the row of the rating table
+# with date <= :date < nextdate.
+_INTERPOLATED_RATING = """rating + (nextrating - rating) *
+                          (:date - date) / CAST(nextdate - date AS REAL)"""
+
+# Format of the period and the date precision at which it is known.
+_PERIODS = {
+    'year': ('%Y', 3),
+    'month': ('%Y-%m', 2),
+    'day': ('%Y-%m-%d', 1),
+}
+
+
+def _date_range(start, end):
+    """Parameters of the queries of the games in a date range."""
+    return {'start': -(1 << 63) if start is None else start,
+            'end': (1 << 63) - 1 if end is None else end}
+
+
+class GameFilter(object):
+    """A condition on the games, compiled into the WHERE clause of a query.
+
+    The filters are made by tag_filter, date_filter and player_filter, and
+    combined with &, | and ~. The conditions are on the indexed columns of the
+    game and tag tables, so SQLite only reads the games that match.
+    """
+
+    def __init__(self, sql, params=()):
+        self.sql = sql
+        self.params = tuple(params)
+
+    def __and__(self, other):
+        return GameFilter('({}) AND ({})'.format(self.sql, other.sql),
+                          self.params + other.params)
+
+    def __or__(self, other):
+        return GameFilter('({}) OR ({})'.format(self.sql, other.sql),
+                          self.params + other.params)
+
+    def __invert__(self):
+        return GameFilter('NOT ({})'.format(self.sql), self.params)
+
+
+def _placeholders(values):
+    return ', '.join('?' * len(values))
+
+
+def tag_filter(name, values=None, like=None):
+    """The games with the tag equal to one of values, or matching like.
+
+    values is a string or a list of strings and like a pattern of the SQL
+    LIKE operator, which ignores the case of ASCII letters. Without either,
+    the games that have the tag.
+    """
+    if isinstance(values, str):
+        values = [values]
+    sql = """gameid IN (SELECT gameid FROM tag
+                        WHERE tagnameid=(SELECT tagnameid FROM main.tagname
+                                         WHERE name=?)"""
+    params = [name]
+    if values is not None:
+        sql += ' AND value IN ({})'.format(_placeholders(values))
+        params += values
+    if like is not None:
+        sql += ' AND value LIKE ?'
+        params.append(like)
+    return GameFilter(sql + ')', params)
+
+
+def date_filter(start=None, end=None):
+    """The games with dates in [start, end), as timestamps."""
+    params = _date_range(start, end)
+    return GameFilter('date >= ? AND date < ?',
+                      (params['start'], params['end']))
+
+
+def player_filter(playerids):
+    """The games of any of the players."""
+    playerids = list(playerids)
+    return GameFilter(
+        'playerid1 IN ({0}) OR playerid2 IN ({0})'.format(
+            _placeholders(playerids)),
+        playerids * 2)
+
+
+# Columns of the results of the games, the players, the days since the epoch
+# and the results as in Game.result.
+GameResults = collections.namedtuple('GameResults',
+                                     ['player1', 'player2', 'day', 'result'])
+
+_GAME_RESULTS_DTYPES = (np.int32, np.int32, np.int32, np.int8)
+
+
+def _empty_game_results(size):
+    return GameResults(*(np.empty(size, dtype=dtype)
+                         for dtype in _GAME_RESULTS_DTYPES))
+
+
+def _resize_game_results(columns, size):
+    resized = _empty_game_results(size)
+    for column, new_column in zip(columns, resized):
+        n = min(len(column), size)
+        new_column[:n] = column[:n]
+    return resized
+
+
+def _min_games_mask(player1, player2, mingames):
+    """Mask of the games of the players with at least mingames games.
+
+    Removing the games of a player can leave its opponents with too few
+    games, so the players are removed until all the remaining ones have
+    enough: the games of the mingames-core of the graph of the players.
+    """
+    nplayers = max(player1.max(initial=0), player2.max(initial=0)) + 1
+    counts = (np.bincount(player1, minlength=nplayers) +
+              np.bincount(player2, minlength=nplayers))
+    # The games left, only they are checked again.
+    remaining = np.arange(len(player1))
+    while len(remaining):
+        weak = counts < mingames
+        drop = weak[player1[remaining]] | weak[player2[remaining]]
+        if not drop.any():
+            break
+        dropped = remaining[drop]
+        counts -= (np.bincount(player1[dropped], minlength=nplayers) +
+                   np.bincount(player2[dropped], minlength=nplayers))
+        remaining = remaining[~drop]
+    keep = np.zeros(len(player1), dtype=bool)
+    keep[remaining] = True
+    return keep
+
+
+def filter_min_games(columns, mingames):
+    """Keep the GameResults of the players with at least mingames games.
+
+    The games are counted among the ones kept, see _min_games_mask.
+    """
+    if mingames <= 1:
+        return columns
+    keep = _min_games_mask(columns.player1, columns.player2, mingames)
+    return GameResults(*(column[keep] for column in columns))
+
+
 class DuplicateGameError(Exception):
     pass
 
 
+_MASK64 = (1 << 64) - 1
+
+
+class MovesFilter(object):
+    """Bloom filter of moves hashes.
+
+    Tells whether a game with the given moves hash may have been added. With
+    up to capacity hashes, false positives happen about 1% of the time, false
+    negatives never.
+    """
+
+    BITS_PER_HASH = 10
+    NUM_PROBES = 7
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.count = 0
+        self._nbits = max(64, capacity * self.BITS_PER_HASH)
+        self._bits = bytearray((self._nbits + 7) // 8)
+
+    def _positions(self, h):
+        h &= _MASK64
+        step = (h >> 32) | 1
+        return [((h + i * step) & _MASK64) % self._nbits
+                for i in range(self.NUM_PROBES)]
+
+    def add(self, h):
+        for pos in self._positions(h):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def add_all(self, hashes):
+        """Add an array of hashes at once."""
+        hashes = np.asarray(hashes, dtype=np.int64).view(np.uint64)
+        step = (hashes >> np.uint64(32)) | np.uint64(1)
+        bits = np.frombuffer(self._bits, dtype=np.uint8)
+        for i in range(self.NUM_PROBES):
+            # The arithmetic wraps around at 64 bits, as in _positions.
+            pos = (hashes + np.uint64(i) * step) % np.uint64(self._nbits)
+            np.bitwise_or.at(bits, (pos >> np.uint64(3)).astype(np.intp),
+                             np.left_shift(1, pos & np.uint64(7))
+                               .astype(np.uint8))
+        self.count += len(hashes)
+
+    def __contains__(self, h):
+        bits = self._bits
+        for pos in self._positions(h):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+
 class DataBase(object):
+    """Games database in an SQLite file.
+
+    With wal the database is switched to write-ahead logging, which is
+    remembered in the file. Then the readers see the last commit while the
+    games are written, and the writes are safe from crashes: the commits are
+    only synced at the WAL checkpoints, so a power loss may lose the last
+    ones, but never corrupts the database. Without WAL the writes are not
+    synced at all.
+
+    A read_only database can be used by a different thread than the one that
+    opened it, one at a time, see DataBasePool.
+
+    The games can be split by date between several files, see add_shard. The
+    main file keeps the players, the other tables and the games outside the
+    ranges of the shards. The shards are attached to the connection, and the
+    game and tag tables are temporary views of the union of the games and the
+    tags of all the files, so the queries read all the shards. The new games
+    are written to the shard of their date.
+    """
 
-    def __init__(self, path='games.db'):
-        self._conn = sqlite3.connect(path)
+    def __init__(self, path='games.db', packed_moves=None, wal=False,
+                 read_only=False):
+        if read_only:
+            uri = pathlib.Path(os.path.abspath(path)).as_uri() + '?mode=ro'
+            self._conn = sqlite3.connect(uri, uri=True,
+                                         check_same_thread=False)
+        else:
+            self._conn = sqlite3.connect(path)
         self._conn.execute('PRAGMA cache_size=10000000')
-        self._conn.execute('PRAGMA synchronous=OFF')
-        if self._unintialized():
+        if wal and not read_only:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+        cursor = self._conn.cursor()
+        cursor.execute('PRAGMA journal_mode')
+        self._wal = cursor.fetchone()[0] == 'wal'
+        self._conn.execute('PRAGMA synchronous=' + self._synchronous())
+        self._read_only = read_only
+        # (schema, start, end) of the attached shards, see add_shard.
+        self._shards = None
+        # Name -> playerid of all the players, loaded on first use.
+        self._player_ids = None
+        # Name -> tagnameid of all the tag names, loaded on first use.
+        self._tag_name_ids = None
+        # MovesFilter of all the games, see use_moves_filter.
+        self._moves_filter = None
+        if not read_only:
+            # The schema only creates the tables and indices that are missing,
+            # so it also upgrades the databases created by older versions.
+            self._upgrade_schema()
             self.create_schema(path='games.sql')
+        self._attach_shards()
+        self._codec = MoveCodec()
+        self.refresh()
+        # Pack the moves of new games if asked to, or if it was done before.
+        if packed_moves is None:
+            packed_moves = len(self._codec) > 0
+        self._packed_moves = packed_moves
 
-    def _unintialized(self):
-        try:
-            self._conn.execute('SELECT count(*) FROM game')
-        except sqlite3.OperationalError:
-            return True
-        return False
+    def refresh(self):
+        """Read the changes made through other connections.
+
+        Loads the moves added to the vocabulary of the packed moves, and
+        whether there is an opening tree.
+        """
+        if not self._conn.in_transaction:
+            # The shards can't be attached in a transaction.
+            self._attach_shards()
+        cursor = self._conn.cursor()
+        # The vocabulary only grows.
+        cursor.execute('SELECT san FROM move WHERE moveid >= ? ORDER BY moveid',
+                       (len(self._codec),))
+        self._codec.add_moves([row[0] for row in cursor])
+        # The index is only created by build_opening_tree.
+        cursor.execute("""SELECT count(*) FROM sqlite_master
+                          WHERE type='index' AND name='game_openingkey'""")
+        self._opening_tree = cursor.fetchone()[0] > 0
+
+    def close(self):
+        self._conn.close()
+
+    def _synchronous(self):
+        return 'NORMAL' if self._wal else 'OFF'
+
+    def _schemas(self):
+        return ['main'] + [schema for schema, _, _ in self._shards]
+
+    def path(self):
+        """Return the path of the main file, or '' if it is in memory."""
+        cursor = self._conn.cursor()
+        cursor.execute('PRAGMA database_list')
+        return [row[2] for row in cursor if row[1] == 'main'][0]
+
+    def _shard_path(self, path):
+        # Relative to the directory of the main file.
+        return os.path.join(os.path.dirname(self.path()), path)
+
+    def _attach_shards(self):
+        """Attach the new shards and create the views of all the games."""
+        cursor = self._conn.cursor()
+        cursor.execute("""SELECT shardid, path, startdate, enddate FROM shard
+                          ORDER BY startdate""")
+        rows = cursor.fetchall()
+        shards = [('shard%d' % shardid, start, end)
+                  for shardid, _, start, end in rows]
+        if shards == self._shards:
+            return
+        attached = set(self._schemas() if self._shards else [])
+        for (schema, _, _), (_, path, _, _) in zip(shards, rows):
+            if schema in attached:
+                continue
+            path = self._shard_path(path)
+            if self._read_only:
+                path = pathlib.Path(path).as_uri() + '?mode=ro'
+            cursor.execute('ATTACH DATABASE ? AS ' + schema, (path,))
+            if self._wal and not self._read_only:
+                cursor.execute('PRAGMA %s.journal_mode=WAL' % schema)
+            cursor.execute('PRAGMA %s.synchronous=%s' %
+                           (schema, self._synchronous()))
+        self._shards = shards
+        self._create_views()
+
+    def _create_views(self):
+        self._drop_views()
+        cursor = self._conn.cursor()
+        for view, columns in (('game', _GAME_COLUMNS), ('tag', _TAG_COLUMNS)):
+            cursor.execute('CREATE TEMP VIEW {} AS {}'.format(
+                view, ' UNION ALL '.join(
+                    'SELECT {} FROM {}.{}'.format(columns, schema, view)
+                    for schema in self._schemas())))
+
+    def _drop_views(self):
+        for view in ('game', 'tag'):
+            self._conn.execute('DROP VIEW IF EXISTS temp.' + view)
+
+    def add_shard(self, path, start, end):
+        """Store the games with the dates in [start, end) in another file.
+
+        The file is created if needed, and the games of the range are moved
+        there from the main file. The dates are timestamps, like Game.date.
+        The ranges of the shards can't overlap. A connection can attach only
+        a limited number of files, 10 by default with the main one.
+        """
+        if start >= end:
+            raise ValueError('Empty date range.')
+        for _, shard_start, shard_end in self._shards:
+            if start < shard_end and shard_start < end:
+                raise ValueError('The date range overlaps another shard.')
+        self.commit()
+        cursor = self._conn.cursor()
+        cursor.execute("""INSERT INTO shard(path, startdate, enddate)
+                          VALUES (?, ?, ?)""", (path, start, end))
+        shardid = cursor.lastrowid
+        self._create_shard(self._shard_path(path), shardid)
+        self.commit()
+        self._attach_shards()
+
+        schema = 'shard%d' % shardid
+        if self._opening_tree:
+            cursor.execute('CREATE INDEX IF NOT EXISTS '
+                           '%s.game_openingkey ON game (openingkey)' % schema)
+        cursor.execute("""CREATE TEMP TABLE IF NOT EXISTS moved_game
+                          (gameid INTEGER PRIMARY KEY)""")
+        cursor.execute("""INSERT INTO moved_game
+                          SELECT gameid FROM main.game
+                          WHERE date >= ? AND date < ?""", (start, end))
+        cursor.execute("""INSERT INTO {}.game({columns})
+                          SELECT {columns} FROM main.game
+                          WHERE gameid IN (SELECT gameid FROM moved_game)
+                          """.format(schema, columns=_GAME_COLUMNS))
+        cursor.execute("""INSERT INTO {}.tag(gameid, tagnameid, value)
+                          SELECT gameid, tagnameid, value FROM main.tag
+                          WHERE gameid IN (SELECT gameid FROM moved_game)
+                          ORDER BY rowid""".format(schema))
+        cursor.execute("""DELETE FROM main.tag
+                          WHERE gameid IN (SELECT gameid FROM moved_game)""")
+        cursor.execute("""DELETE FROM main.game
+                          WHERE gameid IN (SELECT gameid FROM moved_game)""")
+        cursor.execute('DELETE FROM moved_game')
+        self._next_generation()
+        self.commit()
+
+    @staticmethod
+    def _create_shard(path, shardid):
+        conn = sqlite3.connect(path)
+        with open('games.sql') as schema_file:
+            conn.executescript(schema_file.read())
+        # The new games get ids after the ones of the shards before.
+        cursor = conn.cursor()
+        cursor.execute("""UPDATE sqlite_sequence SET seq=max(seq, ?)
+                          WHERE name='game'""", (shardid * _SHARD_GAMEIDS,))
+        if not cursor.rowcount:
+            cursor.execute("""INSERT INTO sqlite_sequence(name, seq)
+                              VALUES ('game', ?)""",
+                           (shardid * _SHARD_GAMEIDS,))
+        conn.commit()
+        conn.close()
+
+    def _schema_for_date(self, date):
+        for schema, start, end in self._shards:
+            if start <= date < end:
+                return schema
+        return 'main'
+
+    def _games_in(self, start, end):
+        """The game table, only with the shards that may have [start, end)."""
+        schemas = ['main'] + [
+            schema for schema, shard_start, shard_end in self._shards
+            if ((start is None or start < shard_end) and
+                (end is None or shard_start < end))]
+        if len(schemas) == len(self._shards) + 1:
+            return 'game'
+        return '({}) AS game'.format(' UNION ALL '.join(
+            'SELECT {} FROM {}.game'.format(_GAME_COLUMNS, schema)
+            for schema in schemas))
+
+    def _upgrade_schema(self):
+        cursor = self._conn.cursor()
+        cursor.execute('PRAGMA table_info(game)')
+        columns = [row[1] for row in cursor]
+        if columns and 'moveshash' not in columns:
+            self._conn.create_function('moves_hash', 1, moves_hash,
+                                       deterministic=True)
+            cursor.execute('ALTER TABLE game ADD COLUMN moveshash INTEGER')
+            cursor.execute('UPDATE game SET moveshash=moves_hash(moves)')
+            cursor.execute('DROP INDEX IF EXISTS game_moves')
+            self.commit()
+        if columns and 'packedmoves' not in columns:
+            cursor.execute('ALTER TABLE game ADD COLUMN packedmoves BLOB')
+            self.commit()
+        if columns and 'openingkey' not in columns:
+            cursor.execute('ALTER TABLE game ADD COLUMN openingkey TEXT')
+            self.commit()
+        cursor.execute('PRAGMA table_info(tag)')
+        if 'name' in [row[1] for row in cursor]:
+            # Move the tag names to the tagname table.
+            cursor.execute('ALTER TABLE tag RENAME TO old_tag')
+            self.create_schema(path='games.sql')
+            cursor.execute("""INSERT INTO tagname(name)
+                              SELECT DISTINCT name FROM old_tag""")
+            cursor.execute("""INSERT INTO tag(gameid, tagnameid, value)
+                              SELECT gameid, tagnameid, value
+                              FROM old_tag JOIN tagname USING (name)
+                              ORDER BY old_tag.rowid""")
+            cursor.execute('DROP TABLE old_tag')
+            self.commit()
+            self._conn.execute('VACUUM')
+
+    def _load_codec(self):
+        cursor = self._conn.cursor()
+        cursor.execute('SELECT san FROM move ORDER BY moveid')
+        return MoveCodec(row[0] for row in cursor)
+
+    def _row_moves(self, moves, packed_moves):
+        if packed_moves is not None:
+            return self._codec.decode(packed_moves)
+        return moves.split()
+
+    def _add_moves(self, moves):
+        """Add the moves to the vocabulary of packed moves."""
+        new_moves = self._codec.add_moves(moves)
+        self._conn.executemany('INSERT INTO move(moveid, san) VALUES (?, ?)',
+                               zip(self._codec.ids(new_moves), new_moves))
+
+    def _game_opening_key(self, game):
+        if not self._opening_tree:
+            return None
+        return _opening_key(game.moves[:OPENING_DEPTH])
+
+    def _moves_columns(self, games):
+        """Return (moves, packedmoves) values for the games."""
+        if not self._packed_moves:
+            return [(game.moves_str(), None) for game in games]
+        for game in games:
+            self._add_moves(game.moves)
+        return [(None, packed) for packed in
+                self._codec.encode_many([game.moves for game in games])]
+
+    def pack_moves(self, batch_size=10000):
+        """Store the moves of all the games packed, see MoveCodec.
+
+        The moves of the games added later are packed as well. The ids of the
+        moves are given in the order of their frequency, so that the most
+        frequent ones take one byte. Vacuums the database afterwards to give
+        the space back.
+        """
+        cursor = self._conn.cursor()
+        counts = collections.Counter()
+        cursor.execute('SELECT moves FROM game WHERE packedmoves IS NULL')
+        for row in cursor:
+            counts.update(row[0].split())
+        self._add_moves(move for move, _ in counts.most_common())
+        self._packed_moves = True
+
+        for schema in self._schemas():
+            last_gameid = -1
+            while True:
+                cursor.execute("""SELECT gameid, moves FROM {}.game
+                                  WHERE packedmoves IS NULL AND gameid > ?
+                                  ORDER BY gameid LIMIT ?""".format(schema),
+                               (last_gameid, batch_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                packed = self._codec.encode_many([row[1].split()
+                                                  for row in rows])
+                cursor.executemany("""UPDATE {}.game
+                                      SET moves=NULL, packedmoves=?
+                                      WHERE gameid=?""".format(schema),
+                                   zip(packed, (row[0] for row in rows)))
+                last_gameid = rows[-1][0]
+        self.commit()
+        # Otherwise VACUUM finds the views instead of the tables.
+        self._drop_views()
+        for schema in self._schemas():
+            self._conn.execute('VACUUM ' + schema)
+        self._create_views()
 
     def create_schema(self, path):
         with open(path) as schema_file:
             self._conn.executescript(schema_file.read())
 
-    def load_game(self, gameid):
+    def load_game(self, gameid, tags=True):
         cursor = self._conn.cursor()
         cursor.execute("""SELECT result, date, dateprecision, moves,
                                  playerid1, player1.name,
-                                 playerid2, player2.name
+                                 playerid2, player2.name, packedmoves
                           FROM game, player as player1, player as player2
                           WHERE gameid=?
                             AND playerid1=player1.playerid
@@ -66,18 +630,264 @@ class DataBase(object):
                     result=row[0],
                     date=row[1],
                     date_precision=row[2],
-                    moves=list(row[3].split()),
+                    moves=self._row_moves(row[3], row[8]),
                     player1_id=row[4],
                     player1_name=row[5],
                     player2_id=row[6],
                     player2_name=row[7])
-        cursor.execute('SELECT name, value FROM tag WHERE gameid=?',
-                       (gameid,))
+        if not tags:
+            return game
+        cursor.execute("""SELECT name, value FROM tag JOIN tagname
+                            USING (tagnameid)
+                          WHERE gameid=?
+                          ORDER BY tagrowid""", (gameid,))
         for row in cursor.fetchall():
             game.add_tag(row[0], row[1])
 
         return game
 
+    def load_games(self, gameids, tags=True):
+        """Load many games at once, see load_game.
+
+        Returns the list of the games in the order of gameids, with None for
+        the ids that are not in the database. The games are read by one query
+        and their tags by another one, whatever the number of games.
+        """
+        gameids = list(gameids)
+        cursor = self._conn.cursor()
+        cursor.execute("""CREATE TEMP TABLE IF NOT EXISTS loaded_game
+                          (gameid INTEGER PRIMARY KEY)""")
+        cursor.execute('DELETE FROM loaded_game')
+        cursor.executemany('INSERT OR IGNORE INTO loaded_game VALUES (?)',
+                           ((gameid,) for gameid in gameids))
+        cursor.execute("""SELECT gameid, result, date, dateprecision, moves,
+                                 playerid1, player1.name,
+                                 playerid2, player2.name, packedmoves
+                          FROM loaded_game
+                            JOIN game USING (gameid)
+                            JOIN player AS player1
+                              ON playerid1=player1.playerid
+                            JOIN player AS player2
+                              ON playerid2=player2.playerid""")
+        games = {}
+        for row in cursor:
+            games[row[0]] = Game(gameid=row[0],
+                                 result=row[1],
+                                 date=row[2],
+                                 date_precision=row[3],
+                                 moves=self._row_moves(row[4], row[9]),
+                                 player1_id=row[5],
+                                 player1_name=row[6],
+                                 player2_id=row[7],
+                                 player2_name=row[8])
+        if tags:
+            tag_names = dict(cursor.execute(
+                'SELECT tagnameid, name FROM tagname'))
+            cursor.execute("""SELECT gameid, tagnameid, value
+                              FROM loaded_game JOIN tag USING (gameid)
+                              ORDER BY tagrowid""")
+            for gameid, tagnameid, value in cursor:
+                games[gameid].add_tag(tag_names[tagnameid], value)
+        cursor.execute('DELETE FROM loaded_game')
+        return [games.get(gameid) for gameid in gameids]
+
+    def iterate_moves(self):
+        """Yield (gameid, list of moves) of all the games."""
+        cursor = self._conn.cursor()
+        cursor.execute("""SELECT gameid, moves, packedmoves FROM game
+                          ORDER BY gameid""")
+        for gameid, moves, packed_moves in cursor:
+            yield gameid, self._row_moves(moves, packed_moves)
+
+    def delete_games(self, gameids):
+        """Delete the games with their tags."""
+        cursor = self._conn.cursor()
+        cursor.execute("""CREATE TEMP TABLE IF NOT EXISTS deleted_game
+                          (gameid INTEGER PRIMARY KEY)""")
+        cursor.executemany('INSERT OR IGNORE INTO deleted_game VALUES (?)',
+                           ((gameid,) for gameid in gameids))
+        if self._opening_tree:
+            cursor.execute("""SELECT openingkey FROM game
+                              WHERE gameid IN (SELECT gameid
+                                               FROM deleted_game)""")
+            self._remove_from_opening_tree([row[0] for row in cursor])
+        for schema in self._schemas():
+            # One pass over the tags, whatever the number of games.
+            cursor.execute("""DELETE FROM {}.tag
+                              WHERE gameid IN (SELECT gameid
+                                               FROM deleted_game)
+                              """.format(schema))
+            cursor.execute("""DELETE FROM {}.game
+                              WHERE gameid IN (SELECT gameid
+                                               FROM deleted_game)
+                              """.format(schema))
+        cursor.execute('DELETE FROM deleted_game')
+        self._next_generation()
+
+    def _next_generation(self):
+        self._conn.execute("""UPDATE property SET value=value+1
+                              WHERE name='generation'""")
+
+    def games_fingerprint(self):
+        """Identify the games, for the caches of the data derived from them.
+
+        Returns a dict with the uuid of the database, the generation, which
+        changes whenever games are deleted or moved, and maxids, the last game
+        id of every file by the schema name. While the uuid and the generation
+        stay the same, the games are only added, with ids after maxids.
+        """
+        cursor = self._conn.cursor()
+        cursor.execute("""SELECT name, value FROM property
+                          WHERE name IN ('uuid', 'generation')""")
+        fingerprint = dict(cursor.fetchall())
+        fingerprint['maxids'] = {}
+        for schema in self._schemas():
+            cursor.execute('SELECT max(gameid) FROM %s.game' % schema)
+            fingerprint['maxids'][schema] = cursor.fetchone()[0] or 0
+        return fingerprint
+
+    def build_opening_tree(self):
+        """Build the opening tree of the first OPENING_DEPTH half-moves.
+
+        Every game gets the key of its opening, and for every prefix of the
+        openings reached by at least two games the number of games is stored
+        in the opening table. A missing prefix was reached by at most one
+        game. From now on the tree is updated when games are added.
+        """
+        cursor = self._conn.cursor()
+        for schema in self._schemas():
+            cursor.execute('DROP INDEX IF EXISTS %s.game_openingkey' % schema)
+            cursor.execute('SELECT gameid, moves, packedmoves FROM %s.game' %
+                           schema)
+            rows = [(_opening_key(self._row_moves(moves, packed_moves)
+                                  [:OPENING_DEPTH]), gameid)
+                    for gameid, moves, packed_moves in cursor.fetchall()]
+            cursor.executemany('UPDATE %s.game SET openingkey=? '
+                               'WHERE gameid=?' % schema, rows)
+            cursor.execute('CREATE INDEX %s.game_openingkey '
+                           'ON game (openingkey)' % schema)
+
+        cursor.execute('DELETE FROM opening')
+        self._conn.executemany('INSERT INTO opening(prefix, ngames) '
+                               'VALUES (?, ?)', self._count_prefixes())
+        self._opening_tree = True
+        self.commit()
+
+    def _count_prefixes(self):
+        """Yield (prefix key, count) of the prefixes of at least two games."""
+        cursor = self._conn.cursor()
+        cursor.execute('SELECT openingkey FROM game ORDER BY openingkey')
+        # Moves and counts of the prefixes of the last key.
+        moves = []
+        counts = []
+        for key, in cursor:
+            key_moves = key.split()
+            common = 0
+            while (common < min(len(moves), len(key_moves)) and
+                   moves[common] == key_moves[common]):
+                common += 1
+            # The sorted keys never come back to the prefixes left.
+            for depth in range(len(moves), common, -1):
+                if counts[depth - 1] >= 2:
+                    yield _opening_key(moves[:depth]), counts[depth - 1]
+            del counts[common:]
+            for i in range(common):
+                counts[i] += 1
+            counts.extend([1] * (len(key_moves) - common))
+            moves = key_moves
+        for depth in range(len(moves), 0, -1):
+            if counts[depth - 1] >= 2:
+                yield _opening_key(moves[:depth]), counts[depth - 1]
+
+    def _add_to_opening_tree(self, keys):
+        """Count the new games with the opening keys, already inserted."""
+        counts = collections.Counter(
+            _opening_key(moves[:depth])
+            for moves in (key.split() for key in keys)
+            for depth in range(1, len(moves) + 1))
+        cursor = self._conn.cursor()
+        # The prefixes extending a prefix come right after it.
+        single = None
+        for prefix in sorted(counts):
+            if single is not None and prefix.startswith(single):
+                continue
+            cursor.execute("""UPDATE opening SET ngames=ngames+?
+                              WHERE prefix=?""", (counts[prefix], prefix))
+            if cursor.rowcount:
+                continue
+            # The prefix had no node, so at most one game before the new ones.
+            cursor.execute("""SELECT count(*) FROM game
+                              WHERE openingkey >= ? AND openingkey < ?""",
+                           (prefix, prefix[:-1] + '!'))
+            ngames = cursor.fetchone()[0]
+            if ngames < 2:
+                single = prefix
+                continue
+            cursor.execute("""INSERT INTO opening(prefix, ngames)
+                              VALUES (?, ?)""", (prefix, ngames))
+
+    def _remove_from_opening_tree(self, keys):
+        cursor = self._conn.cursor()
+        for key in keys:
+            moves = key.split()
+            for depth in range(1, len(moves) + 1):
+                cursor.execute("""UPDATE opening SET ngames=ngames-1
+                                  WHERE prefix=?""",
+                               (_opening_key(moves[:depth]),))
+                if not cursor.rowcount:
+                    break
+        cursor.execute('DELETE FROM opening WHERE ngames < 2')
+
+    def _check_opening_tree(self):
+        if not self._opening_tree:
+            raise ValueError('No opening tree, see build_opening_tree.')
+
+    def count_games_with_prefix(self, moves):
+        """Return the number of games starting with the moves.
+
+        For up to OPENING_DEPTH moves it takes a couple of index lookups.
+        """
+        self._check_opening_tree()
+        if len(moves) > OPENING_DEPTH:
+            return len(self.find_games_with_prefix(moves))
+        cursor = self._conn.cursor()
+        prefix = _opening_key(moves)
+        if moves:
+            cursor.execute('SELECT ngames FROM opening WHERE prefix=?',
+                           (prefix,))
+            row = cursor.fetchone()
+            if row:
+                return row[0]
+        cursor.execute("""SELECT count(*) FROM
+                            (SELECT 1 FROM game
+                             WHERE openingkey >= ? AND openingkey < ?
+                             LIMIT ?)""",
+                       (prefix, prefix[:-1] + '!', 2 if moves else -1))
+        return cursor.fetchone()[0]
+
+    def find_games_with_prefix(self, moves, limit=None):
+        """Return the ids of the games starting with the moves.
+
+        The games are found with a range scan of the opening keys, ordered by
+        the openings.
+        """
+        self._check_opening_tree()
+        prefix = _opening_key(moves[:OPENING_DEPTH])
+        cursor = self._conn.cursor()
+        cursor.execute("""SELECT gameid, moves, packedmoves FROM game
+                          WHERE openingkey >= ? AND openingkey < ?
+                          ORDER BY openingkey""",
+                       (prefix, prefix[:-1] + '!'))
+        gameids = []
+        for gameid, game_moves, packed_moves in cursor:
+            if limit is not None and len(gameids) >= limit:
+                break
+            if (len(moves) <= OPENING_DEPTH or
+                    self._row_moves(game_moves, packed_moves)[:len(moves)] ==
+                    list(moves)):
+                gameids.append(gameid)
+        return gameids
+
     def load_players(self):
         cursor = self._conn.cursor()
         cursor.execute('SELECT playerid, name FROM player')
@@ -86,67 +896,289 @@ class DataBase(object):
             players[row[0]] = row[1]
         return players
 
-    def load_game_results(self, mingames=1):
+    def player_games(self, playerid, start=None, end=None):
+        """Return the games of a player with dates in [start, end).
+
+        The dates are timestamps, like Game.date, and None means no limit.
+        Returns a list of (gameid, date, opponentid, score) ordered by date,
+        where score is 1 for a win, 0.5 for a draw and 0 for a loss.
+        """
         cursor = self._conn.cursor()
+        params = _date_range(start, end)
+        params['player'] = playerid
+        cursor.execute("""SELECT gameid, date, playerid2,
+                                 CASE result WHEN 1 THEN 1.0
+                                             WHEN 0 THEN 0.0
+                                             ELSE 0.5 END
+                          FROM {games}
+                          WHERE playerid1=:player
+                            AND date >= :start AND date < :end
+                          UNION ALL
+                          SELECT gameid, date, playerid1,
+                                 CASE result WHEN 1 THEN 0.0
+                                             WHEN 0 THEN 1.0
+                                             ELSE 0.5 END
+                          FROM {games}
+                          WHERE playerid2=:player
+                            AND date >= :start AND date < :end
+                          ORDER BY 2, 1""".format(
+                              games=self._games_in(start, end)), params)
+        return cursor.fetchall()
 
-        cursor.execute("""SELECT playerid1, playerid2, date / (24*3600), result
-                          FROM game
-                          WHERE dateprecision < 3""")
-        results = []
-        player_games_count = {}
-        for row in cursor:
-            player1, player2, date, result = row
-            results.append((player1, player2, date, result))
-            if player1 not in player_games_count:
-                player_games_count[player1] = 0
-            if player2 not in player_games_count:
-                player_games_count[player2] = 0
-            player_games_count[player1] += 1
-            player_games_count[player1] += 1
-
-        if mingames > 1:
-            return list(filter(lambda x: (player_games_count[x[0]] > mingames and
-                                          player_games_count[x[1]] > mingames),
-                               results))
+    def head_to_head(self, playerid1, playerid2, start=None, end=None):
+        """Return (wins, draws, losses) of player 1 against player 2."""
+        cursor = self._conn.cursor()
+        games = self._games_in(start, end)
+        params = _date_range(start, end)
+        params['player'] = playerid1
+        params['opponent'] = playerid2
+        cursor.execute("""SELECT result, count(*)
+                          FROM {}
+                          WHERE playerid1=:player AND playerid2=:opponent
+                            AND date >= :start AND date < :end
+                          GROUP BY result""".format(games), params)
+        as_white = dict(cursor.fetchall())
+        cursor.execute("""SELECT result, count(*)
+                          FROM {}
+                          WHERE playerid2=:player AND playerid1=:opponent
+                            AND date >= :start AND date < :end
+                          GROUP BY result""".format(games), params)
+        as_black = dict(cursor.fetchall())
+        return (as_white.get(1, 0) + as_black.get(0, 0),
+                as_white.get(2, 0) + as_black.get(2, 0),
+                as_white.get(0, 0) + as_black.get(1, 0))
+
+    def count_player_games(self, playerid, period='year', start=None,
+                           end=None):
+        """Return the number of games of a player in every period.
+
+        period is 'year', 'month' or 'day'. The games with the date known
+        less precisely than the period are not counted. Returns a list of
+        (period, count) in the order of the periods, where the periods are
+        strings like '2010', '2010-09' or '2010-09-30'.
+        """
+        if period not in _PERIODS:
+            raise ValueError('Unknown period: {}'.format(period))
+        period_format, max_precision = _PERIODS[period]
+        cursor = self._conn.cursor()
+        params = _date_range(start, end)
+        params['player'] = playerid
+        params['format'] = period_format
+        params['precision'] = max_precision
+        cursor.execute("""SELECT strftime(:format, date, 'unixepoch'),
+                                 count(*)
+                          FROM (SELECT date
+                                FROM {games}
+                                WHERE playerid1=:player
+                                  AND date >= :start AND date < :end
+                                  AND dateprecision < :precision
+                                UNION ALL
+                                SELECT date
+                                FROM {games}
+                                WHERE playerid2=:player
+                                  AND date >= :start AND date < :end
+                                  AND dateprecision < :precision)
+                          GROUP BY 1
+                          ORDER BY 1""".format(
+                              games=self._games_in(start, end)), params)
+        return cursor.fetchall()
+
+    def _select_game_results(self, start, end, id_ranges, where):
+        """Execute the query of (player1, player2, day, result) of the games.
+
+        Only the games with at least the year known are read.
+        """
+        if id_ranges is None:
+            games = self._games_in(start, end)
         else:
+            games = '({}) AS game'.format(' UNION ALL '.join(
+                """SELECT {} FROM {}.game
+                   WHERE gameid > {:d} AND gameid <= {:d}""".format(
+                       _GAME_COLUMNS, schema, after, last)
+                for schema, (after, last) in id_ranges.items()))
+        where = date_filter(start, end) & (where or GameFilter('1'))
+        cursor = self._conn.cursor()
+        cursor.execute("""SELECT playerid1, playerid2, date / (24*3600), result
+                          FROM {}
+                          WHERE dateprecision < 3 AND ({})
+                          """.format(games, where.sql), where.params)
+        return cursor
+
+    def load_game_results(self, mingames=1, start=None, end=None, where=None):
+        """Return a list of (player1, player2, day, result) of the games.
+
+        Only the games of the players with at least mingames games are
+        returned, see filter_min_games. where is a GameFilter of the games to load. The dates in [start, end)
+        also skip the shards without them.
+        """
+        cursor = self._select_game_results(start, end, None, where)
+        results = cursor.fetchall()
+        if mingames <= 1:
             return results
+        players = np.array([row[:2] for row in results],
+                           dtype=np.int64).reshape(-1, 2)
+        keep = _min_games_mask(players[:, 0], players[:, 1], mingames)
+        return list(itertools.compress(results, keep))
+
+    def load_game_result_columns(self, mingames=1, start=None, end=None,
+                                 chunk_size=1 << 16, id_ranges=None,
+                                 where=None):
+        """Load the game results as NumPy arrays, see load_game_results.
+
+        The rows are fetched chunk_size at a time into typed arrays, without
+        keeping Python objects for the games. The arrays are preallocated and
+        grow geometrically. Returns GameResults.
+
+        id_ranges limits the games to the ids in (after, last] of the files,
+        given as {schema: (after, last)}, see games_fingerprint.
+        """
+        cursor = self._select_game_results(start, end, id_ranges, where)
+        columns = _empty_game_results(chunk_size)
+        ngames = 0
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            if ngames + len(rows) > len(columns.day):
+                columns = _resize_game_results(
+                    columns, max(2 * len(columns.day), ngames + len(rows)))
+            block = np.array(rows, dtype=np.int64)
+            for column, values in zip(columns, block.T):
+                column[ngames:ngames + len(rows)] = values
+            ngames += len(rows)
+        columns = _resize_game_results(columns, ngames)
+        return filter_min_games(columns, mingames)
+
+    def use_moves_filter(self):
+        """Keep a Bloom filter of the moves of all the games in memory.
+
+        After that the games are only looked up in the database if the filter
+        says they may be there, which saves a query for almost every new game
+        of a bulk import.
+        """
+        if self._moves_filter is None:
+            self._build_moves_filter()
+
+    def _build_moves_filter(self):
+        cursor = self._conn.cursor()
+        cursor.execute('SELECT moveshash FROM game')
+        hashes = np.fromiter((row[0] for row in cursor), dtype=np.int64)
+        self._moves_filter = MovesFilter(max(1 << 20, 2 * len(hashes)))
+        self._moves_filter.add_all(hashes)
+
+    def _add_to_moves_filter(self, hashes):
+        moves_filter = self._moves_filter
+        if moves_filter is None:
+            return
+        if moves_filter.count + len(hashes) > moves_filter.capacity:
+            # The games are already in the table.
+            self._build_moves_filter()
+        else:
+            for h in hashes:
+                moves_filter.add(h)
 
     def find_game(self, game):
-        moves = game.moves_str()
+        return self._find_game(game, game.moves_str())
+
+    def _find_game(self, game, moves):
+        h = moves_hash(moves)
+        if self._moves_filter is not None and h not in self._moves_filter:
+            return None
+        # None if some of the moves were never packed.
+        packed_moves = self._codec.encode(game.moves) if self._codec else None
         cursor = self._conn.cursor()
         cursor.execute("""SELECT gameid, result, date, dateprecision,
                                  player1.name, player2.name
                           FROM game, player as player1, player as player2
-                          WHERE moves=?
+                          WHERE moveshash=? AND (moves=? OR packedmoves=?)
                             AND playerid1=player1.playerid
                             AND playerid2=player2.playerid""",
-                       (moves,))
-        for row in cursor.fetchall():
-            if (row[1] == game.result and
-                _dates_compatible(game.date, game.date_precision,
-                                  row[2], row[3]) and
-                lastname_from_name(row[4]) == game.player1_lastname() and
-                lastname_from_name(row[5]) == game.player2_lastname()):
-                return row[0]
-            elif (len(game.moves) >= 19 and
-                _dates_compatible(game.date, game.date_precision,
-                                  row[2], row[3])):
-                raise DuplicateGameError(
-                    'Two games with the same moves, but ' +
-                    'different metadata:\n' +
-                    'DB: ' + str(self.load_game(row[0])) + '\n' +
-                    'New: ' + str(game))
+                       (h, moves, packed_moves))
+        return _match_game(game, cursor.fetchall(),
+                           lambda gameid: str(self.load_game(gameid)))
+
+    def find_games(self, games):
+        """Look up a batch of games.
+
+        Sets gameid of the games that are already in the database. Returns
+        the list of the new games and the list of DuplicateGameErrors for the
+        games that conflict with a game in the database or earlier in the
+        batch. The games matching an earlier game of the batch are not new.
+        """
+        new_games = []
+        errors = []
+        # Moves -> rows of the new games, as in _match_game.
+        pending = {}
+        for game in games:
+            moves = game.moves_str()
+            try:
+                game.gameid = self._find_game(game, moves)
+                if game.gameid:
+                    continue
+                if _match_game(game, pending.get(moves, ()), str):
+                    continue
+            except DuplicateGameError as error:
+                errors.append(error)
+                continue
+            new_games.append(game)
+            pending.setdefault(moves, []).append(
+                (game, game.result, game.date, game.date_precision,
+                 game.player1_name, game.player2_name))
+        return new_games, errors
+
+    def _get_player_ids(self):
+        if self._player_ids is None:
+            cursor = self._conn.cursor()
+            cursor.execute('SELECT name, playerid FROM player')
+            self._player_ids = dict(cursor)
+        return self._player_ids
+
+    def _insert_tag_names(self, games):
+        """Return the tagnameid of every tag name, inserting the new ones."""
+        if self._tag_name_ids is None:
+            cursor = self._conn.cursor()
+            cursor.execute('SELECT name, tagnameid FROM tagname')
+            self._tag_name_ids = dict(cursor)
+        tag_name_ids = self._tag_name_ids
+        names = [name for name in dict.fromkeys(
+                     name for game in games for name in game.tags)
+                 if name not in tag_name_ids]
+        if names:
+            self._conn.executemany('INSERT INTO tagname(name) VALUES (?)',
+                                   ((name,) for name in names))
+            tag_name_ids.update(zip(names, self._inserted_ids(len(names))))
+        return tag_name_ids
 
     def get_player(self, name):
+        player_ids = self._get_player_ids()
+        if name not in player_ids:
+            cursor = self._conn.cursor()
+            cursor.execute('INSERT INTO player(name) VALUES (?)', (name,))
+            player_ids[name] = cursor.lastrowid
+        return player_ids[name]
+
+    def _insert_players(self, games):
+        """Return (playerid1, playerid2) of the games, adding new players."""
+        player_ids = self._get_player_ids()
+        names = [name for name in dict.fromkeys(
+                     name for game in games
+                     for name in (game.player1_name, game.player2_name))
+                 if name not in player_ids]
+        if names:
+            cursor = self._conn.cursor()
+            cursor.executemany('INSERT INTO player(name) VALUES (?)',
+                               ((name,) for name in names))
+            player_ids.update(zip(names, self._inserted_ids(len(names))))
+        return [(game.player1_id or player_ids[game.player1_name],
+                 game.player2_id or player_ids[game.player2_name])
+                for game in games]
+
+    def _inserted_ids(self, count):
+        # The rows inserted by one statement get consecutive ids.
         cursor = self._conn.cursor()
-        cursor.execute('SELECT playerid FROM player WHERE name=?', (name,))
-        row = cursor.fetchone()
-        if row:
-            return row[0]
-        cursor.execute('INSERT INTO player(name) VALUES (?)', (name,))
-        cursor.execute("""SELECT playerid FROM player
-                          WHERE rowid=last_insert_rowid()""")
-        return cursor.fetchone()[0]
+        cursor.execute('SELECT last_insert_rowid()')
+        last = cursor.fetchone()[0]
+        return range(last - count + 1, last + 1)
 
     def add_game(self, game):
         gameid = self.find_game(game)
@@ -154,6 +1186,10 @@ class DataBase(object):
             game.gameid = gameid
             return gameid
 
+        return self.insert_game(game)
+
+    def insert_game(self, game):
+        """Insert a game without checking whether it is already there."""
         if not game.player1_id:
             game.player1_id = self.get_player(game.player1_name)
         if not game.player2_id:
@@ -161,22 +1197,258 @@ class DataBase(object):
 
         cursor = self._conn.cursor()
 
-        cursor.execute("""INSERT INTO game(playerid1, playerid2, result, date,
-                                           dateprecision, moves)
-                          VALUES (?, ?, ?, ?, ?, ?)""",
+        h = moves_hash(game.moves_str())
+        moves, packed_moves = self._moves_columns([game])[0]
+        opening_key = self._game_opening_key(game)
+        schema = self._schema_for_date(game.date)
+        cursor.execute("""INSERT INTO {}.game(playerid1, playerid2, result,
+                                              date, dateprecision, moves,
+                                              packedmoves, openingkey,
+                                              moveshash)
+                          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""".format(schema),
                        (game.player1_id, game.player2_id, game.result,
-                        game.date, game.date_precision, game.moves_str()))
+                        game.date, game.date_precision, moves, packed_moves,
+                        opening_key, h))
+        game.gameid = cursor.lastrowid
+        if opening_key is not None:
+            self._add_to_opening_tree([opening_key])
+        self._add_to_moves_filter([h])
 
-        cursor.execute("""SELECT gameid FROM game
-                          WHERE rowid=last_insert_rowid()""")
-        game.gameid = cursor.fetchone()[0]
-
-        for name, value in game.tags.items():
-            cursor.execute("""INSERT INTO tag(gameid, name, value)
-                              VALUES (?, ?, ?)""",
-                           (game.gameid, name, value))
+        tag_name_ids = self._insert_tag_names([game])
+        cursor.executemany("""INSERT INTO {}.tag(gameid, tagnameid, value)
+                              VALUES (?, ?, ?)""".format(schema),
+                           [(game.gameid, tag_name_ids[name], value)
+                            for name, value in game.tags.items()])
 
         return game.gameid
 
+    def add_games(self, games):
+        """Add a batch of games, skipping the ones already in the database.
+
+        Returns the list of DuplicateGameErrors for the skipped conflicting
+        games.
+        """
+        new_games, errors = self.find_games(games)
+        self.insert_games(new_games)
+        return errors
+
+    def insert_games(self, games):
+        """Insert a batch of games without checking whether they are there.
+
+        The players are resolved through an in-memory cache, the games and
+        their tags are inserted with executemany. Either the whole batch is
+        inserted or nothing. It is committed by commit(), like add_game.
+        """
+        if not games:
+            return
+        if not self._conn.in_transaction:
+            self._conn.execute('BEGIN')
+        self._conn.execute('SAVEPOINT insert_games')
+        try:
+            player_ids = self._insert_players(games)
+
+            cursor = self._conn.cursor()
+            rows = []
+            for game, (player1_id, player2_id), (moves, packed_moves) in zip(
+                    games, player_ids, self._moves_columns(games)):
+                rows.append((player1_id, player2_id, game.result, game.date,
+                             game.date_precision, moves, packed_moves,
+                             self._game_opening_key(game),
+                             moves_hash(game.moves_str())))
+            # The games of every shard, in the order of the batch.
+            shard_games = collections.defaultdict(list)
+            for i, game in enumerate(games):
+                shard_games[self._schema_for_date(game.date)].append(i)
+            gameids = [None] * len(games)
+            tag_name_ids = self._insert_tag_names(games)
+            for schema, indices in shard_games.items():
+                cursor.executemany(
+                    """INSERT INTO {}.game(playerid1, playerid2, result, date,
+                                           dateprecision, moves, packedmoves,
+                                           openingkey, moveshash)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""".format(schema),
+                    [rows[i] for i in indices])
+                for i, gameid in zip(indices,
+                                     self._inserted_ids(len(indices))):
+                    gameids[i] = gameid
+                cursor.executemany(
+                    """INSERT INTO {}.tag(gameid, tagnameid, value)
+                       VALUES (?, ?, ?)""".format(schema),
+                    [(gameids[i], tag_name_ids[name], value)
+                     for i in indices
+                     for name, value in games[i].tags.items()])
+            if self._opening_tree:
+                self._add_to_opening_tree([row[-2] for row in rows])
+        except BaseException:
+            self._conn.execute('ROLLBACK TO insert_games')
+            self._conn.execute('RELEASE insert_games')
+            # The caches may have the players, the tag names and the moves
+            # rolled back.
+            self._player_ids = None
+            self._tag_name_ids = None
+            self._codec = self._load_codec()
+            raise
+        self._conn.execute('RELEASE insert_games')
+        self._add_to_moves_filter([row[-1] for row in rows])
+
+        for game, gameid, (player1_id, player2_id) in zip(games, gameids,
+                                                          player_ids):
+            game.gameid = gameid
+            game.player1_id = player1_id
+            game.player2_id = player2_id
+
+    def get_checkpoint(self, fingerprint):
+        """Return (position, ngames, complete) of a file import, or None."""
+        cursor = self._conn.cursor()
+        cursor.execute("""SELECT position, ngames, complete FROM checkpoint
+                          WHERE fingerprint=?""", (fingerprint,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        return row[0], row[1], bool(row[2])
+
+    def save_checkpoint(self, fingerprint, filename, position, ngames,
+                        complete=False):
+        """Record the progress of a file import and commit.
+
+        The checkpoint is committed together with the games added before it.
+        """
+        self._conn.execute("""INSERT OR REPLACE INTO
+                                checkpoint(fingerprint, filename, position,
+                                           ngames, complete)
+                              VALUES (?, ?, ?, ?, ?)""",
+                           (fingerprint, filename, position, ngames,
+                            int(complete)))
+        self.commit()
+
+    def save_ratings(self, ratings, description=''):
+        """Store ratings computed by Optimizer.run and commit.
+
+        ratings is {playerid: {day: rating}} with the days since the epoch,
+        as in load_game_results. Returns the runid of the ratings.
+        """
+        cursor = self._conn.cursor()
+        cursor.execute("""INSERT INTO ratingrun(created, description)
+                          VALUES (?, ?)""",
+                       (int(datetime.datetime.now().timestamp()), description))
+        runid = cursor.lastrowid
+        rows = []
+        for playerid, player_ratings in ratings.items():
+            points = sorted((day * 24 * 3600, float(rating))
+                            for day, rating in player_ratings.items())
+            next_points = points[1:] + [(_LAST_RATING_DATE, points[-1][1])]
+            for (date, rating), (next_date, next_rating) in zip(points,
+                                                                next_points):
+                rows.append((runid, playerid, date, rating, next_date,
+                             next_rating))
+        cursor.executemany("""INSERT INTO rating(runid, playerid, date, rating,
+                                                 nextdate, nextrating)
+                              VALUES (?, ?, ?, ?, ?, ?)""", rows)
+        self.commit()
+        return runid
+
+    def rating_runs(self):
+        """Return (runid, created, description) of all the stored ratings."""
+        cursor = self._conn.cursor()
+        cursor.execute("""SELECT runid, created, description FROM ratingrun
+                          ORDER BY runid""")
+        return cursor.fetchall()
+
+    def load_ratings(self, runid):
+        """Return the ratings of a run in the format of save_ratings."""
+        cursor = self._conn.cursor()
+        cursor.execute("""SELECT playerid, date, rating FROM rating
+                          WHERE runid=?""", (runid,))
+        ratings = {}
+        for playerid, date, rating in cursor:
+            ratings.setdefault(playerid, {})[date // (24 * 3600)] = rating
+        return ratings
+
+    def rating_on(self, runid, playerid, date):
+        """Return the rating of a player at a timestamp, or None.
+
+        The rating is interpolated between the dates of the stored ratings,
+        and stays at the last one after them. Before the first one the player
+        has no rating.
+        """
+        cursor = self._conn.cursor()
+        cursor.execute("""SELECT {} FROM rating
+                          WHERE runid=:run AND playerid=:player
+                            AND date <= :date
+                          ORDER BY date DESC
+                          LIMIT 1""".format(_INTERPOLATED_RATING),
+                       {'run': runid, 'player': playerid, 'date': date})
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def top_ratings(self, runid, date, n=10, max_inactive=None):
+        """Return the n best (playerid, rating) at a timestamp, see rating_on.
+
+        With max_inactive only the players with a rating in the max_inactive
+        seconds before date are ranked, which also reads much less of the
+        index.
+        """
+        cursor = self._conn.cursor()
+        cursor.execute("""SELECT playerid, {} AS interpolated FROM rating
+                          WHERE runid=:run
+                            AND date <= :date AND date >= :first
+                            AND nextdate > :date
+                          ORDER BY interpolated DESC
+                          LIMIT :n""".format(_INTERPOLATED_RATING),
+                       {'run': runid, 'date': date, 'n': n,
+                        'first': (-(1 << 63) if max_inactive is None
+                                  else date - max_inactive)})
+        return cursor.fetchall()
+
     def commit(self):
         self._conn.commit()
+
+
+class DataBasePool(object):
+    """A pool of read-only connections to a database for worker threads.
+
+    Every reader sees the database as of its first query, even if it is
+    written in the meantime. With WAL the readers don't wait for the writer,
+    see DataBase.
+    """
+
+    def __init__(self, path='games.db', size=4):
+        self._path = path
+        self._size = size
+        self._free = queue.Queue()
+        self._lock = threading.Lock()
+        self._databases = []
+
+    @contextlib.contextmanager
+    def reader(self):
+        """Borrow a read-only DataBase for a with block."""
+        db = self._get()
+        try:
+            db._attach_shards()
+            # Reads one snapshot until the transaction ends, the vocabulary
+            # of the moves is refreshed from it.
+            db._conn.execute('BEGIN')
+            db.refresh()
+            yield db
+        finally:
+            if db._conn.in_transaction:
+                db._conn.rollback()
+            self._free.put(db)
+
+    def _get(self):
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._databases) < self._size:
+                db = DataBase(self._path, read_only=True)
+                self._databases.append(db)
+                return db
+        return self._free.get()
+
+    def close(self):
+        with self._lock:
+            for db in self._databases:
+                db.close()
+            self._databases = []
@@ -1,27 +1,253 @@
+import argparse
+import contextlib
+import hashlib
+import os.path
+import queue
 import sys
+import threading
+import time
 
-from game import PGNParser
-from gamesdb import DataBase, DuplicateGameError
+from game import StreamPGNParser, is_compressed, open_pgn, parse_file_parallel
+from gamesdb import DataBase
 
-if len(sys.argv) < 2:
-    print('Usage:\npython3 import_pgn.py <pgn files>')
-    exit(0)
+RANGE_SIZE = 1 << 24
+BATCH_SIZE = 256
+QUEUE_SIZE = 16
+CHECKPOINT_GAMES = 10000
 
-db = DataBase('games.db')
 
-for filename in sys.argv[1:]:
-    parser = PGNParser(open(filename, encoding='iso-8859-1'))
-    errors = []
-    for game in parser.parse():
+class Progress(object):
+    """Throughput of the import stages, printed at most every interval seconds.
+
+    The rate of a stage is the amount of work it has done divided by the time
+    it spent doing it, without the time it waited for the other stages. The
+    stage with the lowest rate is the bottleneck.
+    """
+
+    STAGES = ('read', 'parse', 'lookup', 'write')
+
+    def __init__(self, interval=5.0, out=sys.stdout):
+        self._interval = interval
+        self._out = out
+        self._lock = threading.Lock()
+        self._amounts = dict.fromkeys(self.STAGES, 0)
+        self._seconds = dict.fromkeys(self.STAGES, 0.0)
+        self._start = time.monotonic()
+        self._last_report = self._start
+
+    def add(self, stage, amount, seconds):
+        with self._lock:
+            self._amounts[stage] += amount
+            self._seconds[stage] += seconds
+
+    def rate(self, stage):
+        with self._lock:
+            if not self._seconds[stage]:
+                return None
+            return self._amounts[stage] / self._seconds[stage]
+
+    def report(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_report < self._interval:
+            return
+        self._last_report = now
+
+        games = self._amounts['lookup']
+        elapsed = now - self._start
+        parts = ['%d games in %.0fs, %.0f games/s' %
+                 (games, elapsed, games / elapsed if elapsed else 0)]
+        for stage in self.STAGES:
+            rate = self.rate(stage)
+            if rate is None:
+                continue
+            if stage == 'read':
+                parts.append('read %.1f MB/s' % (rate / (1 << 20)))
+            else:
+                parts.append('%s %.0f games/s' % (stage, rate))
+        self.message(' | '.join(parts))
+
+    def message(self, text):
+        print(text, file=self._out, flush=True)
+
+
+def file_fingerprint(filename, block_size=1 << 20):
+    """Identify a file by its size and the hash of its first and last blocks."""
+    size = os.path.getsize(filename)
+    digest = hashlib.sha1(str(size).encode())
+    with open(filename, 'rb') as pgn_file:
+        digest.update(pgn_file.read(block_size))
+        if size > block_size:
+            pgn_file.seek(max(block_size, size - block_size))
+            digest.update(pgn_file.read())
+    return digest.hexdigest()
+
+
+def _put(batches, item, stop):
+    while not stop.is_set():
         try:
-            db.add_game(game)
-        except DuplicateGameError as error:
-            errors.append(error)
-        print(game)
-    db.commit()
+            batches.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _parse_file(filename, processes, progress, position):
+    if processes:
+        yield from parse_file_parallel(filename, processes=processes,
+                                       range_size=RANGE_SIZE, start=position,
+                                       offsets=True)
+    else:
+        def read_progress(size, seconds):
+            progress.add('read', size, seconds)
+
+        with open_pgn(filename, progress=read_progress,
+                      offset=position) as pgn_file:
+            parser = StreamPGNParser(pgn_file, offset=position)
+            yield from parser.parse_with_offsets()
+
+
+def _parse_batches(filename, jobs, position, batches, stop, progress):
+    try:
+        if (jobs > 1 and not is_compressed(filename) and
+                os.path.getsize(filename) > RANGE_SIZE):
+            processes = jobs
+        else:
+            processes = 0
+        # With a process pool the thread only waits for the workers, so the
+        # wall time is counted. Otherwise the CPU time of the thread is the
+        # time it spent parsing, not waiting for the reader or the queue.
+        clock = time.monotonic if processes else time.thread_time
+        games = _parse_file(filename, processes, progress, position)
+        with contextlib.closing(games):
+            # Batches of games with the offset after the last one.
+            batch = []
+            start = clock()
+            for game, position in games:
+                batch.append(game)
+                if len(batch) == BATCH_SIZE:
+                    progress.add('parse', len(batch), clock() - start)
+                    if not _put(batches, (batch, position), stop):
+                        return
+                    batch = []
+                    start = clock()
+            progress.add('parse', len(batch), clock() - start)
+        if _put(batches, (batch, position), stop):
+            _put(batches, None, stop)
+    except Exception as error:
+        _put(batches, error, stop)
+
+
+def _store_batch(db, batch, progress, errors):
+    start = time.monotonic()
+    new_games, batch_errors = db.find_games(batch)
+    found = time.monotonic()
+    db.insert_games(new_games)
+    progress.add('lookup', len(batch), found - start)
+    progress.add('write', len(new_games), time.monotonic() - found)
+    errors += batch_errors
+
+
+def import_file(db, filename, jobs=1, progress=None,
+                checkpoint_games=CHECKPOINT_GAMES):
+    """Import the games from a PGN file into the database.
+
+    The import runs in concurrent stages connected by bounded queues: the file
+    is read and decompressed in one thread, parsed in another one (or in a
+    pool of jobs processes for large files), and the games are looked up and
+    written to the database in the calling thread, which owns the connection.
+    Looking up and writing share the thread, so that every lookup sees all the
+    games written before it. The database is only queried for the games that
+    may be there according to its moves filter, see
+    DataBase.use_moves_filter.
+
+    Every checkpoint_games games the import is committed together with a
+    checkpoint: the fingerprint of the file, the offset after the last game
+    and the number of games. An interrupted import is resumed from the last
+    checkpoint, and a file that was imported in full is skipped.
+
+    Returns the list of DuplicateGameErrors for the games that were skipped.
+    """
+    progress = progress or Progress()
+    db.use_moves_filter()
+    fingerprint = file_fingerprint(filename)
+    position, ngames, complete = (db.get_checkpoint(fingerprint) or
+                                  (0, 0, False))
+    if complete:
+        progress.message('Already imported, skipping.')
+        return []
+    if position:
+        progress.message('Resuming after %d games at byte %d.' %
+                         (ngames, position))
+
+    batches = queue.Queue(QUEUE_SIZE)
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=_parse_batches,
+        args=(filename, jobs, position, batches, stop, progress),
+        daemon=True)
+    thread.start()
+
+    errors = []
+    last_checkpoint = ngames
+    try:
+        while True:
+            item = batches.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            batch, position = item
+            _store_batch(db, batch, progress, errors)
+            ngames += len(batch)
+            if ngames - last_checkpoint >= checkpoint_games:
+                db.save_checkpoint(fingerprint, filename, position, ngames)
+                last_checkpoint = ngames
+            progress.report()
+    finally:
+        stop.set()
+        thread.join()
+    db.save_checkpoint(fingerprint, filename, position, ngames, complete=True)
+    return errors
+
+
+def main(args):
+    db = DataBase(args.games, wal=args.wal)
+    if args.pack_moves:
+        db.pack_moves()
+    progress = Progress()
+
+    errors = []
+    for filename in args.files:
+        print(filename)
+        errors += import_file(db, filename, args.jobs, progress)
+        progress.report(force=True)
+
+    if args.opening_tree:
+        db.build_opening_tree()
+
+    if len(errors):
+        print('Errors:')
+        for e in errors:
+            print(e)
+
+
+def parse_command_line():
+    parser = argparse.ArgumentParser(description='Import PGN files.')
+
+    parser.add_argument('files', nargs='*', metavar='FILE')
+    parser.add_argument('-g', '--games', default='games.db')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of processes parsing large files')
+    parser.add_argument('--pack-moves', action='store_true',
+                        help='store the moves of all the games packed')
+    parser.add_argument('--wal', action='store_true',
+                        help='use write-ahead logging, so that the database '
+                             'can be read during the import')
+    parser.add_argument('--opening-tree', action='store_true',
+                        help='build the opening tree, then keep it updated')
 
-if len(errors):
-    print('Errors:')
-    for e in errors:
-        print(e)
+    return parser.parse_args()
 
+if __name__ == '__main__':
+    main(parse_command_line())
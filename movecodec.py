@@ -0,0 +1,111 @@
+import numpy as np
+
+
+def encode_varints(values):
+    """Encode non-negative integers as LEB128 varints, 7 bits per byte."""
+    return _encode_varints(np.asarray(values, dtype=np.uint64))[0].tobytes()
+
+
+def encode_varints_many(sequences):
+    """Encode each of the sequences of integers, see encode_varints.
+
+    All the sequences are encoded at once, which is faster than one by one.
+    """
+    lengths = [len(values) for values in sequences]
+    values = np.fromiter((value for values in sequences for value in values),
+                         dtype=np.uint64, count=sum(lengths))
+    data, nbytes = _encode_varints(values)
+    data = data.tobytes()
+    byte_ends = np.r_[0, np.cumsum(nbytes)][np.cumsum(lengths, dtype=np.intp)]
+    result = []
+    start = 0
+    for end in byte_ends.tolist():
+        result.append(data[start:end])
+        start = end
+    return result
+
+
+def _encode_varints(values):
+    nbytes = np.ones(len(values), dtype=np.intp)
+    for bits in range(7, 64, 7):
+        nbytes += values >= np.uint64(1 << bits)
+    out = np.empty(nbytes.sum(), dtype=np.uint8)
+    offsets = np.cumsum(nbytes) - nbytes
+    for k in range(nbytes.max(initial=0)):
+        mask = nbytes > k
+        byte = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7f)
+        # The high bit is set on all the bytes but the last one of a value.
+        byte |= np.where(nbytes[mask] > k + 1, np.uint64(0x80), np.uint64(0))
+        out[offsets[mask] + k] = byte
+    return out, nbytes
+
+
+def decode_varints(data):
+    """Decode a buffer of LEB128 varints into an array of integers."""
+    data = np.frombuffer(data, dtype=np.uint8)
+    if not len(data):
+        return np.zeros(0, dtype=np.int64)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.r_[0, ends[:-1] + 1]
+    lengths = ends - starts + 1
+    values = (data[starts] & 0x7f).astype(np.int64)
+    for k in range(1, lengths.max(initial=0)):
+        mask = lengths > k
+        values[mask] |= ((data[starts[mask] + k] & 0x7f).astype(np.int64) <<
+                         (7 * k))
+    return values
+
+
+class MoveCodec(object):
+    """Packs lists of moves into bytes using a vocabulary of moves.
+
+    Every move is stored as the varint of its id in the vocabulary, so the
+    moves with ids below 128 take one byte and the next 16256 take two. The
+    vocabulary only grows, new moves get the next ids.
+    """
+
+    def __init__(self, moves=()):
+        self._moves = []
+        self._ids = {}
+        self._array = None
+        self.add_moves(moves)
+
+    def __len__(self):
+        return len(self._moves)
+
+    def add_moves(self, moves):
+        """Add moves to the vocabulary, return the ones that were new."""
+        new_moves = []
+        for move in moves:
+            if move not in self._ids:
+                self._ids[move] = len(self._moves)
+                self._moves.append(move)
+                new_moves.append(move)
+        if new_moves:
+            self._array = None
+        return new_moves
+
+    def ids(self, moves):
+        """Return the ids of the moves, or None if some are unknown."""
+        try:
+            return [self._ids[move] for move in moves]
+        except KeyError:
+            return None
+
+    def encode(self, moves):
+        """Pack a list of moves, or return None if some are unknown."""
+        ids = self.ids(moves)
+        if ids is None:
+            return None
+        return encode_varints(ids)
+
+    def encode_many(self, move_lists):
+        """Pack lists of moves, which must all be in the vocabulary."""
+        return encode_varints_many([[self._ids[move] for move in moves]
+                                    for moves in move_lists])
+
+    def decode(self, data):
+        """Unpack a list of moves."""
+        if self._array is None:
+            self._array = np.array(self._moves, dtype=object)
+        return self._array[decode_varints(data)].tolist()
@@ -20,6 +20,12 @@ except ImportError:
   def minimize(func, x0, method='CG', options=None, jac=None, callback=None):
       method = method.lower()
 
+      if jac is True:
+          # func returns the value and the gradient, and caches them.
+          fused = func
+          func = lambda x: fused(x)[0]
+          jac = lambda x: fused(x)[1]
+
       if 'disp' in options:
           disp = options['disp']
       else:
@@ -180,6 +186,20 @@ class LogisticProbabilityFunction(object):
         return d * np.array([-1 / (2 * self.s),
                             (self.mu - x) / (2 * self.s)])
 
+    def calc_all_vector(self, x):
+        """Return y = (x - mu) / s, log(f(x)), log(1 - f(x)), f(x), sech2(y).
+
+        All of them from a single exponential, for the objective and the
+        gradient at once.
+        """
+        y = (x - self.mu) / self.s
+        e = np.exp(-2 * np.abs(y))
+        log1pe = np.log1p(e)
+        log_f = np.minimum(2 * y, 0) - log1pe
+        log1m_f = np.minimum(-2 * y, 0) - log1pe
+        f = np.where(y >= 0, 1, e) / (1 + e)
+        return y, log_f, log1m_f, f, 4 * e / (1 + e) ** 2
+
     def params_grad_vector(self, x):
         y = (x - self.mu) / self.s
         d = sech2(y)
@@ -203,90 +223,98 @@ class Optimizer(object):
 
         self.objective_calls = 0
         self.gradient_calls = 0
+        self.last_point_ = None
 
     def load_games(self, results):
         """Load the list of game results.
 
         Args:
-            games: list of tuples (player1, player2, date, result)
+            games: list of tuples (player1, player2, date, result), or the
+            columns of the games with attributes player1, player2, day and
+            result, like gamesdb.GameResults.
             Result is 0 for black victory, 1 for white victory, 2 for draw.
         """
-        # Sort games by result: losses, wins, draws.
-        self.games_ = list(sorted(results, key=lambda g: g[3]))
+        if hasattr(results, 'player1'):
+            columns = (results.player1, results.player2, results.day,
+                       results.result)
+        else:
+            columns = tuple(zip(*results)) or ((), (), (), ())
+        player1, player2, date, result = (np.asarray(column, dtype=np.int64)
+                                          for column in columns)
+        # Sort games by result: losses, wins, draws. The sort is stable, like
+        # sorted().
+        order = np.argsort(result, kind='stable')
+        self.games_player1_ = player1[order]
+        self.games_player2_ = player2[order]
+        self.games_date_ = date[order]
+        self.games_result_ = result[order]
+        self.ngames_ = len(order)
         # Fill self.wins_slice_ and so on.
-        self.create_game_result_slices_(self.games_)
-
-        # player -> date -> games count
-        player_date_games_count = self.generate_player_date_games_()
-
-        self.var_player_date_, player_date_var = self.index_rating_vars_(
-            player_date_games_count)
-        self.nrating_vars_ = len(self.var_player_date_)
-
-        self.time_delta_vector_ = self.generate_time_delta_(
-            player_date_games_count)
-
-        self.grad_by_game_m_ = self.create_grad_by_game_(player_date_var)
-
-    def create_grad_by_game_(self, player_date_var):
-        self.games_player1_var_ = []
-        self.games_player2_var_ = []
-        for player1, player2, date, _ in self.games_:
-            self.games_player1_var_.append(player_date_var[(player1, date)])
-            self.games_player2_var_.append(player_date_var[(player2, date)])
-
-        self.games_player1_var_ = np.array(self.games_player1_var_)
-        self.games_player2_var_ = np.array(self.games_player2_var_)
-
-        m = sparse.lil_matrix(
-            (self.nrating_vars_, len(self.games_)), dtype=np.int8)
-
-        for i in range(len(self.games_)):
-            m[self.games_player1_var_[i], i] = 1
-            m[self.games_player2_var_[i], i] = -1
-
-        return m.tocsr()
-
-    def create_game_result_slices_(self, games):
-        last_loss = -1
-        last_win = -1
-        for i in range(len(games)):
-            if games[i][3] == 0:
-                last_loss = i
-                last_win = i
-            elif games[i][3] == 1:
-                last_win = i
-        self.losses_slice_ = slice(0, last_loss + 1)
-        self.wins_slice_ = slice(last_loss + 1, last_win + 1)
-        self.draws_slice_ = slice(last_win + 1, len(self.games_))
-
-    def generate_player_date_games_(self):
-        player_date_games = {}
-        for player1, player2, date, _ in self.games_:
-            if player1 not in player_date_games:
-                player_date_games[player1] = {}
-            if date not in player_date_games[player1]:
-                player_date_games[player1][date] = 0
-            player_date_games[player1][date] += 1
-
-            if player2 not in player_date_games:
-                player_date_games[player2] = {}
-            if date not in player_date_games[player2]:
-                player_date_games[player2][date] = 0
-            player_date_games[player2][date] += 1
-
-        return player_date_games
-
-    def index_rating_vars_(self, player_date_games_count):
-        var_player_date = []
-        player_date_var = {}
-        for player, date_games_count in player_date_games_count.items():
-            for date in sorted(date_games_count.keys()):
-                player_date_var[(player, date)] = len(var_player_date)
-                var_player_date.append((player, date))
-        return var_player_date, player_date_var
-
-    def generate_time_delta_(self, player_date_games):
+        self.create_game_result_slices_(self.games_result_)
+
+        var_games = self.index_rating_vars_()
+        self.nrating_vars_ = len(self.var_player_)
+
+        self.time_delta_vector_ = self.generate_time_delta_(var_games)
+
+        self.grad_by_game_m_ = self.create_grad_by_game_()
+        self.last_point_ = None
+
+    def create_grad_by_game_(self):
+        # The duplicate entries are summed. A game of a player with itself
+        # gets -1, as when m[var2, i] = -1 overwrote m[var1, i] = 1.
+        data = np.concatenate([
+            (self.games_player1_var_ != self.games_player2_var_).astype(
+                np.int8),
+            np.full(self.ngames_, -1, dtype=np.int8)])
+        rows = np.concatenate([self.games_player1_var_,
+                               self.games_player2_var_])
+        columns = np.tile(np.arange(self.ngames_), 2)
+        return sparse.csr_matrix((data, (rows, columns)),
+                                 shape=(self.nrating_vars_, self.ngames_),
+                                 dtype=np.int8)
+
+    def create_game_result_slices_(self, results):
+        # The results are sorted.
+        last_loss, last_win = np.searchsorted(results, [1, 2])
+        self.losses_slice_ = slice(0, last_loss)
+        self.wins_slice_ = slice(last_loss, last_win)
+        self.draws_slice_ = slice(last_win, len(results))
+
+    def index_rating_vars_(self):
+        """Index the ratings of the players at the dates of their games.
+
+        The players are in the order of their first games, player1 before
+        player2, and the dates of a player are sorted. Sets the player and
+        the date of every variable and the variables of the players of the
+        games. Returns the number of games of every variable.
+        """
+        # player1 and player2 of every game, in turn.
+        players = np.stack([self.games_player1_, self.games_player2_],
+                           axis=1).ravel()
+        dates = np.repeat(self.games_date_, 2)
+        unique_players, first, player_index = np.unique(
+            players, return_index=True, return_inverse=True)
+        by_first_game = np.argsort(first)
+        player_rank = np.empty_like(by_first_game)
+        player_rank[by_first_game] = np.arange(len(by_first_game))
+        unique_dates, date_index = np.unique(dates, return_inverse=True)
+
+        keys = (player_rank[player_index.ravel()] * len(unique_dates) +
+                date_index.ravel())
+        var_keys, var_index, var_games = np.unique(
+            keys, return_inverse=True, return_counts=True)
+        self.var_player_ = unique_players[by_first_game][
+            var_keys // len(unique_dates)]
+        self.var_date_ = unique_dates[var_keys % len(unique_dates)]
+        self.var_player_date_ = list(zip(self.var_player_.tolist(),
+                                         self.var_date_.tolist()))
+        var_index = var_index.ravel()
+        self.games_player1_var_ = var_index[0::2].astype(np.intp)
+        self.games_player2_var_ = var_index[1::2].astype(np.intp)
+        return var_games
+
+    def generate_time_delta_(self, var_games):
         """Generate a table of coefficients to rating changes.
 
         1 / (difference in days for subsequent ratings) +
@@ -294,20 +322,12 @@ class Optimizer(object):
 
         TODO: Tune coefficients of each part.
         """
+        same_player = self.var_player_[1:] == self.var_player_[:-1]
+        #delta_vector = same_player / (self.var_date_[1:] - self.var_date_[:-1]
+        #                              + var_games[1:] + var_games[:-1])
+        delta_vector = same_player.astype(np.int64)
 
-        delta_vector = []
-        last_player, last_date = self.var_player_date_[0]
-        last_games = player_date_games[last_player][last_date]
-        for player, date in self.var_player_date_[1:]:
-            games = player_date_games[player][date]
-            if player == last_player:
-                #delta_vector.append(1 / (date - last_date + games + last_games))
-                delta_vector.append(1)
-            else:
-                delta_vector.append(0)
-            last_player, last_date, last_games = player, date, games
-
-        return self.time_delta * np.array(delta_vector)
+        return self.time_delta * delta_vector
 
     def create_vars(self, ratings, fparam):
         v = [0] * self.nrating_vars_
@@ -346,8 +366,8 @@ class Optimizer(object):
 
         smoothness = self.calc_smoothness_(rating_vars)
 
-        f_hard_reg = self.f.hard_reg() * len(self.games_) * self.func_hard_reg
-        f_soft_reg = self.f.soft_reg() * len(self.games_) * self.func_soft_reg
+        f_hard_reg = self.f.hard_reg() * self.ngames_ * self.func_hard_reg
+        f_soft_reg = self.f.soft_reg() * self.ngames_ * self.func_soft_reg
 
         total = (-likelihood + regularization + smoothness +
                   f_hard_reg + f_soft_reg)
@@ -359,10 +379,12 @@ class Optimizer(object):
             return total
 
     def likelihood_grad_(self, rating_diff):
+        return self.likelihood_grad_from_f_(self.f.calc_vector(rating_diff))
+
+    def likelihood_grad_from_f_(self, fdiffs):
         # d likelihood / d f(x)
-        d = np.zeros(len(rating_diff))
+        d = np.zeros(len(fdiffs))
 
-        fdiffs = self.f.calc_vector(rating_diff)
         fdiffs[fdiffs < 1E-10] = 1E-10
         fdiffs[fdiffs > 1 - 1E-10] = 1 - 1E-10
 
@@ -407,13 +429,66 @@ class Optimizer(object):
         g[1:self.nrating_vars_] -= smoothness_grad
 
         g[self.nrating_vars_:] -= (self.f.hard_reg_grad() * self.func_hard_reg *
-                            len(self.games_))
+                            self.ngames_)
         g[self.nrating_vars_:] -= (self.f.soft_reg_grad() * self.func_soft_reg *
-                            len(self.games_))
+                            self.ngames_)
 
         return -g
 
 
+    def objective_and_gradient(self, v):
+        """Return the objective and its gradient at v, in a single pass.
+
+        Computes the rating differences and the function of them once for
+        both. The last point is cached, so asking again for it is free.
+        """
+        if self.last_point_ is not None and np.array_equal(v,
+                                                           self.last_point_):
+            return self.last_value_, self.last_gradient_
+        self.objective_calls += 1
+        self.gradient_calls += 1
+
+        nvars = self.nrating_vars_
+        rating_vars = v[:nvars]
+        self.f.reset_from_vars(v[nvars:])
+
+        rating_diff = (rating_vars[self.games_player1_var_] -
+                       rating_vars[self.games_player2_var_])
+        y, log_f, log1m_f, fdiffs, sech2_y = self.f.calc_all_vector(
+            rating_diff)
+
+        likelihood = (np.sum(log_f[self.wins_slice_]) +
+                      np.sum(log1m_f[self.losses_slice_]) +
+                      np.sum(log_f[self.draws_slice_]) / 2 +
+                      np.sum(log1m_f[self.draws_slice_]) / 2)
+        regularization = np.inner(rating_vars, rating_vars) * self.rating_reg
+        rating_delta = rating_vars[1:] - rating_vars[:-1]
+        smoothness = np.inner(rating_delta ** 2, self.time_delta_vector_)
+        f_hard_reg = self.f.hard_reg() * self.ngames_ * self.func_hard_reg
+        f_soft_reg = self.f.soft_reg() * self.ngames_ * self.func_soft_reg
+        total = (-likelihood + regularization + smoothness +
+                  f_hard_reg + f_soft_reg)
+
+        # The gradient of -total, as in gradient(). f'(x) = sech2(y) / (2 s).
+        t = sech2_y * self.likelihood_grad_from_f_(fdiffs)
+        g = np.empty(len(v), dtype=np.float64)
+        g[:nvars] = self.grad_by_game_m_ * t / (2 * self.f.s)
+        g[nvars:] = [-np.sum(t) / (2 * self.f.s), -0.5 * np.dot(t, y)]
+
+        g[:nvars] -= 2 * self.rating_reg * rating_vars
+
+        smoothness_grad = 2 * self.time_delta_vector_ * rating_delta
+        g[:nvars - 1] += smoothness_grad
+        g[1:nvars] -= smoothness_grad
+
+        g[nvars:] -= self.f.hard_reg_grad() * self.func_hard_reg * self.ngames_
+        g[nvars:] -= self.f.soft_reg_grad() * self.func_soft_reg * self.ngames_
+
+        self.last_point_ = np.array(v, dtype=np.float64)
+        self.last_value_ = total
+        self.last_gradient_ = -g
+        return self.last_value_, self.last_gradient_
+
     def init(self):
         return np.array([random() - 0.5 for i in range(self.nrating_vars_)] +
                            self.f.init())
@@ -440,8 +515,8 @@ class Optimizer(object):
         if (time.time() - self.last_check > 10 and
             self.optimization_steps - self.last_step_check > 10 or
             self.optimization_steps - self.last_step_check > 1000):
-            o = self.objective(xk)
-            gn = np.linalg.norm(self.gradient(xk))
+            o, g = self.objective_and_gradient(xk)
+            gn = np.linalg.norm(g)
 
             print(('Step {}. Objective {}, calculated {} times.\n' +
                   'Gradient norm {}, calculated {} times.').format(
@@ -461,12 +536,15 @@ class Optimizer(object):
         self.start_time = time.time()
         self.last_check = self.start_time
         self.last_step_check = 0
-        grad = (self.gradient if method.lower() in ('cg', 'newton-cg', 'bfgs', 'l-bfgs-b')
-                else None)
+        if method.lower() in ('cg', 'newton-cg', 'bfgs', 'l-bfgs-b'):
+            # The objective and the gradient from one call.
+            func, grad = self.objective_and_gradient, True
+        else:
+            func, grad = self.objective, None
         options = {'disp': self.disp}
         if maxiter:
             options['maxiter'] = maxiter
-        res = minimize(self.objective, init_point,
+        res = minimize(func, init_point,
                        method=method,
                        options=options,
                        jac=grad,
@@ -0,0 +1,132 @@
+import contextlib
+import json
+import os
+import os.path
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import numpy as np
+
+from gamesdb import GameResults, filter_min_games
+
+_META = 'meta.json'
+_LOCK = 'lock'
+
+
+class ResultCache(object):
+    """The results of the games of a database in memory-mapped files.
+
+    The columns of GameResults are stored in raw files in a directory next to
+    the database, together with the fingerprint of the games they were read
+    from, see DataBase.games_fingerprint. When the games were only added
+    since, the new results are appended to the files, otherwise the files are
+    written anew. The arrays returned by load are read-only maps of the
+    files, so that the processes loading the same cache share the memory.
+    """
+
+    def __init__(self, db, directory=None):
+        if directory is None:
+            if not db.path():
+                raise ValueError('No cache for a database in memory.')
+            directory = db.path() + '.results'
+        self._db = db
+        self._directory = directory
+
+    def _file(self, name):
+        return os.path.join(self._directory, name)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with open(self._file(_LOCK), 'w') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _read_meta(self):
+        try:
+            with open(self._file(_META)) as meta_file:
+                return json.load(meta_file)
+        except FileNotFoundError:
+            return None
+
+    def _write_meta(self, meta):
+        # The readers see either the old or the new file.
+        tmp_path = self._file(_META + '.tmp')
+        with open(tmp_path, 'w') as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(tmp_path, self._file(_META))
+
+    def load(self, mingames=1):
+        """Return GameResults of all the games, see load_game_result_columns.
+
+        The cache is brought up to date with the database first.
+        """
+        os.makedirs(self._directory, exist_ok=True)
+        with self._locked():
+            meta = self._read_meta()
+            fingerprint = self._db.games_fingerprint()
+            if not _can_extend(meta, fingerprint):
+                meta = self._rebuild(fingerprint)
+            elif meta['maxids'] != fingerprint['maxids']:
+                meta = self._extend(meta, fingerprint)
+        return filter_min_games(self._map(meta), mingames)
+
+    def _rebuild(self, fingerprint):
+        columns = self._db.load_game_result_columns(id_ranges={
+            schema: (0, last)
+            for schema, last in fingerprint['maxids'].items()})
+        # New names, the old files may still be mapped by other processes.
+        token = uuid.uuid4().hex
+        for name, column in zip(GameResults._fields, columns):
+            with open(self._file(token + '.' + name), 'wb') as column_file:
+                column.tofile(column_file)
+        meta = dict(fingerprint, token=token, count=len(columns.day),
+                    dtypes=[column.dtype.str for column in columns])
+        self._write_meta(meta)
+        for filename in os.listdir(self._directory):
+            if filename not in (_META, _LOCK) and not filename.startswith(
+                    token):
+                os.remove(self._file(filename))
+        return meta
+
+    def _extend(self, meta, fingerprint):
+        columns = self._db.load_game_result_columns(id_ranges={
+            schema: (meta['maxids'][schema], last)
+            for schema, last in fingerprint['maxids'].items()})
+        # The readers of the old meta only map the beginning of the files.
+        for name, column in zip(GameResults._fields, columns):
+            with open(self._file(meta['token'] + '.' + name),
+                      'ab') as column_file:
+                column.tofile(column_file)
+        meta = dict(meta, maxids=fingerprint['maxids'],
+                    count=meta['count'] + len(columns.day))
+        self._write_meta(meta)
+        return meta
+
+    def _map(self, meta):
+        columns = []
+        for name, dtype in zip(GameResults._fields, meta['dtypes']):
+            if not meta['count']:
+                # An empty file can't be mapped.
+                columns.append(np.empty(0, dtype=dtype))
+                continue
+            columns.append(np.memmap(self._file(meta['token'] + '.' + name),
+                                     dtype=dtype, mode='r',
+                                     shape=(meta['count'],)))
+        return GameResults(*columns)
+
+
+def _can_extend(meta, fingerprint):
+    """Whether the cache has some of the games of the fingerprint."""
+    if meta is None:
+        return False
+    if (meta['uuid'] != fingerprint['uuid'] or
+            meta['generation'] != fingerprint['generation'] or
+            set(meta['maxids']) != set(fingerprint['maxids'])):
+        return False
+    return all(fingerprint['maxids'][schema] >= last
+               for schema, last in meta['maxids'].items())
@@ -0,0 +1,67 @@
+import io
+import unittest
+
+from dedup import MinHasher, find_near_duplicates
+from game import PGNParser, Game
+from gamesdb import DataBase
+from test_game import TEST_PGN1, TEST_PGN2
+
+
+def _jaccard(moves1, moves2, n):
+    ngrams1 = set(tuple(moves1[i:i + n]) for i in range(len(moves1) - n + 1))
+    ngrams2 = set(tuple(moves2[i:i + n]) for i in range(len(moves2) - n + 1))
+    return len(ngrams1 & ngrams2) / len(ngrams1 | ngrams2)
+
+
+class TestMinHasher(unittest.TestCase):
+
+    def test_signature(self):
+        moves = PGNParser(io.StringIO(TEST_PGN1)).parse_all()[0].moves
+        hasher = MinHasher(num_perm=256)
+        signature = hasher.signature(moves)
+        self.assertEqual(len(signature), 256)
+        self.assertTrue((signature == hasher.signature(list(moves))).all())
+        self.assertIsNone(hasher.signature(moves[:3]))
+
+        truncated = moves[:-10]
+        estimate = (signature == hasher.signature(truncated)).mean()
+        self.assertAlmostEqual(estimate, _jaccard(moves, truncated, 4),
+                               delta=0.1)
+
+        other = PGNParser(io.StringIO(TEST_PGN2)).parse_all()[0].moves
+        self.assertLess((signature == hasher.signature(other)).mean(), 0.1)
+
+
+class TestFindNearDuplicates(unittest.TestCase):
+
+    def test_find(self):
+        db = DataBase(path=':memory:')
+        game = PGNParser(io.StringIO(TEST_PGN1)).parse_all()[0]
+        other = PGNParser(io.StringIO(TEST_PGN2)).parse_all()[0]
+
+        def add(moves, player1=game.player1_name, date='1992-11-04'):
+            return db.add_game(Game(result=game.result,
+                                    player1_name=player1,
+                                    player2_name=game.player2_name,
+                                    date=date,
+                                    moves=moves))
+
+        id1 = add(game.moves)
+        id2 = add(game.moves[:-2], date='1992-11-??')
+        # Different player.
+        add(game.moves[:-4], player1='Pupkin, Vasily')
+        # Much shorter.
+        add(game.moves[:30])
+        add(other.moves)
+
+        duplicates = find_near_duplicates(db)
+        self.assertEqual([(d[0], d[1]) for d in duplicates], [(id1, id2)])
+        self.assertGreater(duplicates[0][2], 0.8)
+
+        db.delete_games([id2])
+        self.assertIsNone(db.load_game(id2))
+        self.assertEqual(find_near_duplicates(db), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
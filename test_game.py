@@ -1,8 +1,15 @@
+import bz2
 import datetime
+import gzip
 import io
+import lzma
+import os.path
+import tempfile
 import unittest
+import zipfile
 
-from game import Game, PGNParser
+from game import (Game, MappedPGNParser, PGNParser, StreamPGNParser,
+                  map_file, open_pgn, parse_file_parallel, split_pgn)
 
 
 TEST_PGN1 = """
@@ -354,6 +361,47 @@ class TestPGNParser(unittest.TestCase):
         self.assertEqual(games[3].date_str(), '????-??-??')
         self.assertEqual(games[3].date_precision, 3)
 
+    def test_lazy_moves(self):
+        for pgn in (TEST_PGN1, TEST_PGN3):
+            expected = PGNParser(io.StringIO(pgn)).parse_all()
+            games = PGNParser(io.StringIO(pgn), moves='lazy').parse_all()
+            self.assertIsNone(games[0]._moves)
+            self.assertEqual(games[0].moves, expected[0].moves)
+            self.assertIsNotNone(games[0]._moves)
+
+            data = pgn.encode('iso-8859-1')
+            games = MappedPGNParser(data, moves='lazy').parse_all()
+            self.assertIsNone(games[0]._moves)
+            self.assertEqual(games[0].moves, expected[0].moves)
+
+    def test_skip_moves(self):
+        games = PGNParser(io.StringIO(TEST_PGN2), moves='skip').parse_all()
+        self.assertEqual(len(games), 2)
+        self.assertIsNone(games[0].moves)
+        self.assertEqual(games[1].player1_name, 'Eee, Bbb')
+        self.assertEqual(games[1].date_str(), '1990-12-05')
+        self.assertTrue(str(games[0]).find('Aaa') >= 0)
+
+        data = TEST_PGN3.encode('iso-8859-1')
+        games = MappedPGNParser(data, moves='skip').parse_all()
+        self.assertEqual(len(games), 1)
+        self.assertIsNone(games[0].moves)
+        self.assertEqual(games[0].result, 1)
+
+        with self.assertRaises(ValueError):
+            PGNParser(io.StringIO(TEST_PGN2), moves='none')
+
+    def test_compact_games(self):
+        games = PGNParser(io.StringIO(TEST_PGN4)).parse_all()
+        self.assertFalse(hasattr(games[0], '__dict__'))
+        self.assertIs(games[0].player1_name, games[2].player1_name)
+        self.assertIs(games[0].player1_name, games[0].tags['White'])
+        self.assertIs(list(games[0].tags)[0], list(games[1].tags)[0])
+
+        data = TEST_PGN4.encode('iso-8859-1')
+        mapped_games = MappedPGNParser(data).parse_all()
+        self.assertIs(mapped_games[1].player2_name, games[1].player2_name)
+
     def test_str(self):
         game = Game(result=1,
                     player1_name='Pupkin, Vasily',
@@ -379,6 +427,220 @@ class TestPGNParser(unittest.TestCase):
         self.assertTrue(s.find('2010-09') >= 0)
 
 
+class TestMappedPGNParser(unittest.TestCase):
+
+    def assertSameGames(self, pgn, end=None):
+        data = pgn.encode('iso-8859-1')
+        expected_pgn = data[:end].decode('iso-8859-1')
+        expected = PGNParser(io.StringIO(expected_pgn)).parse_all()
+        games = MappedPGNParser(data, end=end).parse_all()
+
+        self.assertEqual(len(games), len(expected))
+        for game, expected_game in zip(games, expected):
+            self.assertEqual(game.result, expected_game.result)
+            self.assertEqual(game.player1_name, expected_game.player1_name)
+            self.assertEqual(game.player2_name, expected_game.player2_name)
+            self.assertEqual(game.date, expected_game.date)
+            self.assertEqual(game.date_precision, expected_game.date_precision)
+            self.assertEqual(game.moves, expected_game.moves)
+            self.assertEqual(game.tags, expected_game.tags)
+
+    def test_same_as_pgn_parser(self):
+        self.assertSameGames(TEST_PGN1)
+        self.assertSameGames(TEST_PGN2)
+        self.assertSameGames(TEST_PGN3)
+        self.assertSameGames(TEST_PGN4)
+        self.assertSameGames(TEST_PGN2.replace('\n', '\r\n'))
+        self.assertSameGames(TEST_PGN2.replace('"1-0"]', '"1-0"] junk'))
+        self.assertSameGames(TEST_PGN2.replace('[Round "29"]', '[Round "29"'))
+        self.assertSameGames(TEST_PGN2.replace('[Round "29"]',
+                                               '[Event "Duplicate"]'))
+
+    def test_escaped_tag(self):
+        pgn = TEST_PGN2.replace('F/S Return Match', r'The \"Match\"')
+        self.assertSameGames(pgn)
+        games = MappedPGNParser(pgn.encode('iso-8859-1')).parse_all()
+        self.assertEqual(games[0].tags['Event'], 'The "Match"')
+
+    def test_range(self):
+        data = TEST_PGN2.encode('iso-8859-1')
+        start = data.rfind(b'[Event')
+        games = MappedPGNParser(data, start=start).parse_all()
+        self.assertEqual(len(games), 1)
+        self.assertEqual(games[0].player1_name, 'Eee, Bbb')
+
+        games = MappedPGNParser(data, end=start).parse_all()
+        self.assertEqual(len(games), 1)
+        self.assertEqual(games[0].player1_name, 'Aaa, Bbb')
+
+        end = TEST_PGN3.encode('iso-8859-1').find(b'[WhiteElo')
+        self.assertSameGames(TEST_PGN3, end=end)
+        self.assertSameGames(TEST_PGN3, end=end - 1)
+        self.assertSameGames(TEST_PGN3, end=end + 3)
+        self.assertSameGames(TEST_PGN2, end=start - 1)
+
+    def test_map_file(self):
+        with tempfile.TemporaryFile() as pgn_file:
+            pgn_file.write(TEST_PGN1.encode('iso-8859-1'))
+            pgn_file.flush()
+            with map_file(pgn_file) as data:
+                games = MappedPGNParser(data).parse_all()
+            self.assertTrue(data.closed)
+        self.assertEqual(len(games), 1)
+        self.assertEqual(len(games[0].moves), 85)
+
+        with tempfile.TemporaryFile() as pgn_file:
+            with map_file(pgn_file) as data:
+                self.assertEqual(MappedPGNParser(data).parse_all(), [])
+
+    def assertSameGamesSplit(self, data, range_size):
+        ranges = list(split_pgn(data, range_size))
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], len(data))
+        for (_, end), (start, _) in zip(ranges[:-1], ranges[1:]):
+            self.assertEqual(end, start)
+
+        games = []
+        for start, end in ranges:
+            games += MappedPGNParser(data, start, end).parse_all()
+        expected = MappedPGNParser(data).parse_all()
+        self.assertEqual([(g.date, g.player1_name, g.moves) for g in games],
+                         [(g.date, g.player1_name, g.moves) for g in expected])
+        return ranges
+
+    def test_split(self):
+        data = ((TEST_PGN2 + TEST_PGN3 + TEST_PGN4) * 3).encode('iso-8859-1')
+        self.assertEqual(len(self.assertSameGamesSplit(data, 1)), 21)
+        self.assertSameGamesSplit(data, 1000)
+
+        # The unclosed comment swallows the rest of the games.
+        pgn = TEST_PGN2.replace('1. e4 e5', '1. e4 { e5') + TEST_PGN4
+        data = pgn.encode('iso-8859-1')
+        self.assertEqual(len(self.assertSameGamesSplit(data, 1)), 1)
+        self.assertEqual(len(MappedPGNParser(data).parse_all()), 1)
+
+        pgn = TEST_PGN2.replace('1. e4 e5', '1. e4 { e5') + TEST_PGN3
+        data = pgn.encode('iso-8859-1')
+        self.assertEqual(len(self.assertSameGamesSplit(data, 1)), 2)
+
+        self.assertEqual(list(split_pgn(b'', 1)), [(0, 0)])
+
+    def test_parse_file_parallel(self):
+        filename = os.path.join(os.path.dirname(__file__), '365chess',
+                                'Alexander_Morozevich.pgn')
+        with open(filename, 'rb') as pgn_file, map_file(pgn_file) as data:
+            expected = MappedPGNParser(data).parse_all()
+        games = list(parse_file_parallel(filename, processes=2,
+                                         range_size=100000))
+        self.assertEqual(len(games), len(expected))
+        self.assertEqual([(g.date, g.player1_name, g.moves) for g in games],
+                         [(g.date, g.player1_name, g.moves) for g in expected])
+
+        with open(filename, 'rb') as pgn_file, map_file(pgn_file) as data:
+            offsets = [o for _, o in
+                       MappedPGNParser(data).parse_with_offsets()]
+        games = list(parse_file_parallel(filename, processes=2,
+                                         range_size=100000,
+                                         start=offsets[100], offsets=True))
+        self.assertEqual([o for _, o in games], offsets[101:])
+        self.assertEqual([g.moves for g, _ in games],
+                         [g.moves for g in expected[101:]])
+
+
+class TestCompressedPGN(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.data = (TEST_PGN1 + TEST_PGN2 + TEST_PGN3).encode('iso-8859-1')
+        self.expected = [(g.date, g.player1_name, g.moves)
+                         for g in MappedPGNParser(self.data).parse_all()]
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def assertParsed(self, games):
+        self.assertEqual([(g.date, g.player1_name, g.moves) for g in games],
+                         self.expected)
+
+    def test_stream_parser(self):
+        for chunk_size in (1, 7, 100, 1 << 20):
+            parser = StreamPGNParser(io.BytesIO(self.data),
+                                     chunk_size=chunk_size)
+            self.assertParsed(parser.parse_all())
+
+        # The unclosed comment swallows the next game.
+        data = (TEST_PGN2.replace('1. e4 e5', '1. e4 { e5') +
+                TEST_PGN3).encode('iso-8859-1')
+        expected = MappedPGNParser(data).parse_all()
+        games = StreamPGNParser(io.BytesIO(data), chunk_size=50).parse_all()
+        self.assertEqual([g.moves for g in games], [g.moves for g in expected])
+
+    def test_open_compressed(self):
+        paths = [self.write('games.pgn', self.data),
+                 self.write('games.pgn.gz', gzip.compress(self.data)),
+                 self.write('games.pgn.bz2', bz2.compress(self.data)),
+                 self.write('games.pgn.xz', lzma.compress(self.data))]
+        for path in paths:
+            with open_pgn(path, chunk_size=100) as pgn_file:
+                self.assertParsed(StreamPGNParser(pgn_file).parse_all())
+            with open_pgn(path, encoding='iso-8859-1') as pgn_file:
+                self.assertParsed(PGNParser(pgn_file).parse_all())
+
+    def test_open_zip(self):
+        path = os.path.join(self.tmpdir.name, 'games.zip')
+        with zipfile.ZipFile(path, 'w') as archive:
+            archive.writestr('1.pgn', TEST_PGN1.strip())
+            archive.writestr('2.pgn', (TEST_PGN2 + TEST_PGN3).strip())
+        with open_pgn(path) as pgn_file:
+            self.assertParsed(StreamPGNParser(pgn_file).parse_all())
+
+    def test_offsets(self):
+        games = list(MappedPGNParser(self.data).parse_with_offsets())
+        self.assertParsed(game for game, _ in games)
+        for chunk_size in (1, 100, 1 << 20):
+            parser = StreamPGNParser(io.BytesIO(self.data),
+                                     chunk_size=chunk_size)
+            self.assertEqual([offset for _, offset in
+                              parser.parse_with_offsets()],
+                             [offset for _, offset in games])
+
+        # Parsing restarted at an offset gives the rest of the games.
+        for i, (_, offset) in enumerate(games):
+            rest = MappedPGNParser(self.data, offset).parse_all()
+            self.assertEqual([g.moves for g in rest],
+                             [g.moves for g, _ in games[i + 1:]])
+            parser = StreamPGNParser(io.BytesIO(self.data[offset:]),
+                                     chunk_size=7, offset=offset)
+            self.assertEqual([o for _, o in parser.parse_with_offsets()],
+                             [o for _, o in games[i + 1:]])
+
+    def test_open_offset(self):
+        paths = [self.write('games.pgn', self.data),
+                 self.write('games.pgn.gz', gzip.compress(self.data))]
+        zip_path = os.path.join(self.tmpdir.name, 'games.zip')
+        with zipfile.ZipFile(zip_path, 'w') as archive:
+            archive.writestr('1.pgn', self.data[:100])
+            archive.writestr('2.pgn', self.data[100:])
+        zip_data = self.data[:100] + b'\n' + self.data[100:] + b'\n'
+
+        for offset in (0, 50, 100, 101, 102, 500):
+            for path in paths:
+                with open_pgn(path, chunk_size=30, offset=offset) as pgn_file:
+                    self.assertEqual(pgn_file.read(), self.data[offset:])
+            with open_pgn(zip_path, chunk_size=30, offset=offset) as pgn_file:
+                self.assertEqual(pgn_file.read(), zip_data[offset:])
+
+    def test_close_early(self):
+        path = self.write('games.pgn.gz', gzip.compress(self.data * 100))
+        with open_pgn(path, chunk_size=100) as pgn_file:
+            self.assertEqual(len(pgn_file.read(1000)), 1000)
+
 
 if __name__ == '__main__':
     unittest.main()
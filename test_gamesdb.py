@@ -1,7 +1,17 @@
+import concurrent.futures
+import io
+import os.path
+import sqlite3
+import tempfile
 import unittest
 
-from game import PGNParser, Game, _parse_date
-from gamesdb import DataBase, _dates_compatible
+import numpy as np
+
+from game import PGNParser, Game, _parse_date, moves_hash
+from gamesdb import (DataBase, DataBasePool, DuplicateGameError,
+                     MovesFilter, _dates_compatible, date_filter,
+                     player_filter, tag_filter)
+from test_game import TEST_PGN1, TEST_PGN2
 
 
 class TestGamesDB(unittest.TestCase):
@@ -161,6 +171,579 @@ class TestGamesDB(unittest.TestCase):
         self.assertEqual(db.find_game(game2), id1)
 
 
+    def test_add_games(self):
+        db = DataBase(path=':memory:')
+        moves = ['e4', 'e5', 'Nf3', 'Nc6', 'Bb5', 'a6', 'Ba4', 'Nf6', 'O-O',
+                 'Be7', 'Re1', 'b5', 'Bb3', 'd6', 'c3', 'O-O', 'h3', 'Nb8',
+                 'd4', 'Nbd7']
+        id0 = db.get_player('Syutkin, Vladimir')
+
+        game1 = Game(result=1,
+                     player1_name='Pupkin, Vasily',
+                     player2_name='Syutkin, Vladimir',
+                     date='2010-09-30',
+                     moves=moves,
+                     tags={'Round': '13', 'Event': 'Abc'})
+        game2 = Game(result=0,
+                     player1_name='Assange, Julian',
+                     player2_name='Pupkin, Vasily',
+                     date='2005-06-??',
+                     moves=['e4', 'e5'])
+        # Duplicate of game1 in the same batch.
+        game3 = Game(result=1,
+                     player1_name='Pupkin, V',
+                     player2_name='Syutkin, Vladimir',
+                     date='2010-??-??',
+                     moves=moves)
+        # Same moves as game1, but a different result.
+        game4 = Game(result=0,
+                     player1_name='Pupkin, Vasily',
+                     player2_name='Syutkin, Vladimir',
+                     date='2010-09-30',
+                     moves=moves)
+
+        errors = db.add_games([game1, game2, game3, game4])
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], DuplicateGameError)
+        self.assertIsNotNone(game1.gameid)
+        self.assertIsNotNone(game2.gameid)
+        self.assertNotEqual(game1.gameid, game2.gameid)
+        self.assertIsNone(game3.gameid)
+        self.assertIsNone(game4.gameid)
+        self.assertEqual(game1.player2_id, id0)
+        self.assertEqual(game1.player1_id, game2.player2_id)
+        self.assertEqual(db.get_player('Assange, Julian'), game2.player1_id)
+        self.assertEqual(len(db.load_players()), 3)
+
+        game1_test = db.load_game(game1.gameid)
+        self.assertEqual(game1_test.moves, moves)
+        self.assertEqual(game1_test.player1_name, 'Pupkin, Vasily')
+        self.assertEqual(game1_test.player2_name, 'Syutkin, Vladimir')
+        self.assertEqual(game1_test.tags, {'Round': '13', 'Event': 'Abc'})
+        self.assertEqual(db.load_game(game2.gameid).player1_name,
+                         'Assange, Julian')
+
+        # The second time the games are found.
+        game5 = Game(result=1,
+                     player1_name='Pupkin, Vasily',
+                     player2_name='Syutkin, Vladimir',
+                     date='2010-09-30',
+                     moves=moves)
+        self.assertEqual(db.add_games([game5]), [])
+        self.assertEqual(game5.gameid, game1.gameid)
+
+    def test_insert_games_rollback(self):
+        db = DataBase(path=':memory:')
+        db.add_game(Game(result=1,
+                         player1_name='Pupkin, Vasily',
+                         player2_name='Syutkin, Vladimir',
+                         date='2010-09-30',
+                         moves=['e4', 'e5']))
+        game = Game(result=1,
+                    player1_name='Assange, Julian',
+                    player2_name='Syutkin, Vladimir',
+                    date='2010-09-30',
+                    moves=['d4', 'd5'],
+                    tags={'Round': object()})
+        with self.assertRaises(Exception):
+            db.insert_games([game])
+        self.assertIsNone(game.gameid)
+        self.assertIsNone(game.player1_id)
+        self.assertEqual(len(db.load_players()), 2)
+        self.assertEqual(len(db.load_game_results()), 1)
+
+        game.tags['Round'] = '1'
+        db.insert_games([game])
+        self.assertEqual(db.load_game(game.gameid).player1_name,
+                         'Assange, Julian')
+
+    def test_upgrade_moves_hash(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'games.db')
+            conn = sqlite3.connect(path)
+            conn.executescript("""
+                CREATE TABLE game (
+                  gameid INTEGER PRIMARY KEY AUTOINCREMENT,
+                  playerid1 INTEGER, playerid2 INTEGER, result INTEGER,
+                  date INTEGER, dateprecision INTEGER, nmoves INTEGER,
+                  moves TEXT);
+                CREATE INDEX game_moves ON game (moves);
+                CREATE TABLE player (
+                  playerid INTEGER PRIMARY KEY AUTOINCREMENT,
+                  name TEXT, firstnames TEXT, lastname TEXT);
+                INSERT INTO player(name) VALUES ('Pupkin, Vasily');
+                INSERT INTO player(name) VALUES ('Syutkin, Vladimir');
+                INSERT INTO game(playerid1, playerid2, result, date,
+                                 dateprecision, moves)
+                  VALUES (1, 2, 1, 1285804800, 0, 'e4 e5 Nf3');
+            """)
+            conn.close()
+
+            db = DataBase(path=path)
+            game = Game(result=1,
+                        player1_name='Pupkin, Vasily',
+                        player2_name='Syutkin, Vladimir',
+                        date='2010-09-??',
+                        moves=['e4', 'e5', 'Nf3'])
+            self.assertEqual(db.find_game(game), 1)
+            indices = [row[0] for row in db._conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='index'")]
+            self.assertIn('game_moveshash', indices)
+            self.assertNotIn('game_moves', indices)
+            db._conn.close()
+
+    def test_upgrade_tag_names(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'games.db')
+            db = DataBase(path=path)
+            db._conn.executescript("""
+                DROP TABLE main.tag;
+                CREATE TABLE main.tag (gameid INTEGER, name TEXT,
+                                       value TEXT);
+            """)
+            db._conn.close()
+            conn = sqlite3.connect(path)
+            conn.executescript("""
+                INSERT INTO player(name) VALUES ('Pupkin, Vasily');
+                INSERT INTO player(name) VALUES ('Syutkin, Vladimir');
+                INSERT INTO game(playerid1, playerid2, result, date,
+                                 dateprecision, moves)
+                  VALUES (1, 2, 1, 1285804800, 0, 'e4 e5 Nf3');
+                INSERT INTO tag VALUES (1, 'Event', 'Moscow Open');
+                INSERT INTO tag VALUES (1, 'Round', '1');
+            """)
+            conn.close()
+
+            db = DataBase(path=path)
+            self.assertEqual(db.load_game(1).tags,
+                             {'Event': 'Moscow Open', 'Round': '1'})
+            indices = [row[0] for row in db._conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='index'")]
+            self.assertIn('tag_gameid', indices)
+            db._conn.close()
+
+    def test_load_games(self):
+        db = DataBase(path=':memory:')
+        games = PGNParser(io.StringIO(TEST_PGN1 + TEST_PGN2)).parse_all()
+        db.add_games(games[:1])
+        db.add_games(games[1:])
+        gameids = [game.gameid for game in games]
+
+        loaded = db.load_games([gameids[1], 1000, gameids[0]])
+        self.assertIsNone(loaded[1])
+        for game, expected in zip([loaded[2], loaded[0]], games):
+            self.assertEqual(game.tags, expected.tags)
+            self.assertEqual(list(game.tags), list(expected.tags))
+            self.assertEqual(game.moves, expected.moves)
+            self.assertEqual(game.player1_name, expected.player1_name)
+            self.assertEqual(game.date, expected.date)
+            self.assertEqual(game.tags, db.load_game(game.gameid).tags)
+        self.assertEqual(db.load_games(gameids, tags=False)[0].tags, {})
+        self.assertEqual(db.load_games([]), [])
+
+        # The tag names are stored once.
+        self.assertEqual(
+            db._conn.execute('SELECT count(*) FROM tagname').fetchone()[0],
+            len(set(games[0].tags) | set(games[1].tags)))
+
+    def test_moves_filter(self):
+        hashes = [moves_hash(str(i)) for i in range(2000)]
+        moves_filter = MovesFilter(1000)
+        for h in hashes[:500]:
+            moves_filter.add(h)
+        moves_filter.add_all(hashes[500:1000])
+        self.assertEqual(moves_filter.count, 1000)
+        for h in hashes[:1000]:
+            self.assertIn(h, moves_filter)
+        false_positives = sum(h in moves_filter for h in hashes[1000:])
+        self.assertLess(false_positives, 50)
+
+        # add and add_all set the same bits.
+        other = MovesFilter(1000)
+        other.add_all(hashes[:500])
+        for h in hashes[500:1000]:
+            other.add(h)
+        self.assertEqual(other._bits, moves_filter._bits)
+
+    def test_find_game_with_moves_filter(self):
+        db = DataBase(path=':memory:')
+        game1 = Game(result=1,
+                     player1_name='Pupkin, Vasily',
+                     player2_name='Syutkin, Vladimir',
+                     date='2010-09-30',
+                     moves=['e4', 'e5'])
+        id1 = db.add_game(game1)
+        db.use_moves_filter()
+        game2 = Game(result=1,
+                     player1_name='Pupkin, Vasily',
+                     player2_name='Syutkin, Vladimir',
+                     date='2010-09-30',
+                     moves=['d4', 'd5'])
+        self.assertNotIn(game2.moves_hash(), db._moves_filter)
+        self.assertIsNone(db.find_game(game2))
+        id2 = db.add_game(game2)
+        self.assertIn(game2.moves_hash(), db._moves_filter)
+
+        game3 = Game(result=1,
+                     player1_name='Pupkin, V',
+                     player2_name='Syutkin, Vladimir',
+                     date='2010-??-??',
+                     moves=['e4', 'e5'])
+        game4 = Game(result=1,
+                     player1_name='Pupkin, V',
+                     player2_name='Syutkin, Vladimir',
+                     date='2010-??-??',
+                     moves=['d4', 'd5'])
+        self.assertEqual(db.add_games([game3, game4]), [])
+        self.assertEqual((game3.gameid, game4.gameid), (id1, id2))
+
+    def test_packed_moves(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'games.db')
+            db = DataBase(path=path)
+            moves1 = ['e4', 'e5', 'Nf3', 'Nc6', 'Bb5']
+            moves2 = ['e4', 'c5', 'Nf3', 'd6']
+            game1 = Game(result=1,
+                         player1_name='Pupkin, Vasily',
+                         player2_name='Syutkin, Vladimir',
+                         date='2010-09-30',
+                         moves=moves1)
+            id1 = db.add_game(game1)
+            db.pack_moves()
+            self.assertEqual(db.load_game(id1).moves, moves1)
+
+            game2 = Game(result=0,
+                         player1_name='Pupkin, Vasily',
+                         player2_name='Syutkin, Vladimir',
+                         date='2010-09-30',
+                         moves=moves2)
+            db.add_games([game2])
+            db.commit()
+            db._conn.close()
+
+            # The moves stay packed after reopening.
+            db = DataBase(path=path)
+            self.assertTrue(db._packed_moves)
+            row = db._conn.execute(
+                'SELECT moves, packedmoves FROM game WHERE gameid=?',
+                (game2.gameid,)).fetchone()
+            self.assertIsNone(row[0])
+            self.assertEqual(len(row[1]), len(moves2))
+            self.assertEqual(db.load_game(game2.gameid).moves, moves2)
+            self.assertEqual(list(db.iterate_moves()),
+                             [(id1, moves1), (game2.gameid, moves2)])
+
+            game3 = Game(result=1,
+                         player1_name='Pupkin, V',
+                         player2_name='Syutkin, Vladimir',
+                         date='2010-??-??',
+                         moves=moves1)
+            self.assertEqual(db.find_game(game3), id1)
+            game4 = Game(result=1,
+                         player1_name='Pupkin, V',
+                         player2_name='Syutkin, Vladimir',
+                         date='2010-??-??',
+                         moves=moves1 + ['a6'])
+            self.assertIsNone(db.find_game(game4))
+            self.assertEqual(db.load_game(db.add_game(game4)).moves,
+                             moves1 + ['a6'])
+            db._conn.close()
+
+    def test_opening_tree(self):
+        db = DataBase(path=':memory:')
+
+        def add(moves, date='2010-09-30'):
+            return db.add_game(Game(result=1,
+                                    player1_name='Pupkin, Vasily',
+                                    player2_name='Syutkin, Vladimir',
+                                    date=date,
+                                    moves=moves))
+
+        ruy_lopez = ['e4', 'e5', 'Nf3', 'Nc6', 'Bb5']
+        id1 = add(ruy_lopez)
+        id2 = add(['e4', 'c5', 'Nf3', 'd6'])
+        with self.assertRaises(ValueError):
+            db.count_games_with_prefix(['e4'])
+        db.build_opening_tree()
+
+        self.assertEqual(db.count_games_with_prefix([]), 2)
+        self.assertEqual(db.count_games_with_prefix(['e4']), 2)
+        self.assertEqual(db.count_games_with_prefix(['e4', 'e5']), 1)
+        self.assertEqual(db.count_games_with_prefix(['d4']), 0)
+        self.assertEqual(sorted(db.find_games_with_prefix(['e4'])),
+                         [id1, id2])
+        self.assertEqual(db.find_games_with_prefix(['e4', 'c5']), [id2])
+
+        # The tree is updated by both ways of adding games.
+        id3 = add(ruy_lopez + ['a6'], date='2011-09-30')
+        games = [Game(result=0,
+                      player1_name='Pupkin, Vasily',
+                      player2_name='Syutkin, Vladimir',
+                      date='2012-09-30',
+                      moves=ruy_lopez + ['Nf6']),
+                 Game(result=0,
+                      player1_name='Pupkin, Vasily',
+                      player2_name='Syutkin, Vladimir',
+                      date='2013-09-30',
+                      moves=['e4', 'e5', 'Nf3', 'd6'])]
+        db.add_games(games)
+        self.assertEqual(db.count_games_with_prefix(['e4']), 5)
+        self.assertEqual(db.count_games_with_prefix(['e4', 'e5']), 4)
+        self.assertEqual(db.count_games_with_prefix(ruy_lopez), 3)
+        self.assertEqual(db.count_games_with_prefix(ruy_lopez + ['a6']), 1)
+        self.assertEqual(db.find_games_with_prefix(ruy_lopez + ['a6']),
+                         [id3])
+        self.assertEqual(len(db.find_games_with_prefix(['e4'], limit=2)), 2)
+
+        db.delete_games([id3, games[0].gameid])
+        self.assertEqual(db.count_games_with_prefix(['e4', 'e5']), 2)
+        self.assertEqual(db.count_games_with_prefix(ruy_lopez), 1)
+        # The same counts as building the tree from scratch.
+        self.assertEqual(
+            dict(db._conn.execute('SELECT prefix, ngames FROM opening')),
+            dict(db._count_prefixes()))
+
+    def test_opening_tree_long_prefix(self):
+        db = DataBase(path=':memory:')
+        moves = ['Nf3', 'Nf6', 'Ng1', 'Ng8'] * 6
+        gameid = db.add_game(Game(result=1,
+                                  player1_name='Pupkin, Vasily',
+                                  player2_name='Syutkin, Vladimir',
+                                  date='2010-09-30',
+                                  moves=moves))
+        db.build_opening_tree()
+        self.assertEqual(db.count_games_with_prefix(moves), 1)
+        self.assertEqual(db.find_games_with_prefix(moves), [gameid])
+        self.assertEqual(db.count_games_with_prefix(moves[:-1] + ['e4']), 0)
+
+    def test_player_queries(self):
+        db = DataBase(path=':memory:')
+
+        def add(player1, player2, result, date):
+            game = Game(result=result,
+                        player1_name=player1,
+                        player2_name=player2,
+                        date=date,
+                        moves=['e4', date, player1])
+            db.add_game(game)
+            return game
+
+        game1 = add('Pupkin, Vasily', 'Syutkin, Vladimir', 1, '2010-09-30')
+        game2 = add('Syutkin, Vladimir', 'Pupkin, Vasily', 1, '2010-10-02')
+        game3 = add('Pupkin, Vasily', 'Syutkin, Vladimir', 2, '2011-01-15')
+        game4 = add('Pupkin, Vasily', 'Ivanov, Ivan', 0, '2011-??-??')
+        pupkin = game1.player1_id
+        syutkin = game1.player2_id
+
+        self.assertEqual(db.player_games(pupkin),
+                         [(game1.gameid, game1.date, syutkin, 1.0),
+                          (game2.gameid, game2.date, syutkin, 0.0),
+                          (game4.gameid, game4.date, game4.player2_id, 0.0),
+                          (game3.gameid, game3.date, syutkin, 0.5)])
+        self.assertEqual(
+            [row[0] for row in db.player_games(syutkin, start=game2.date,
+                                               end=game3.date)],
+            [game2.gameid])
+
+        self.assertEqual(db.head_to_head(pupkin, syutkin), (1, 1, 1))
+        self.assertEqual(db.head_to_head(syutkin, pupkin), (1, 1, 1))
+        self.assertEqual(db.head_to_head(pupkin, syutkin, start=game2.date),
+                         (0, 1, 1))
+        self.assertEqual(db.head_to_head(pupkin, game4.player2_id),
+                         (0, 0, 1))
+
+        self.assertEqual(db.count_player_games(pupkin),
+                         [('2010', 2), ('2011', 2)])
+        self.assertEqual(db.count_player_games(pupkin, 'month'),
+                         [('2010-09', 1), ('2010-10', 1), ('2011-01', 1)])
+        self.assertEqual(db.count_player_games(syutkin, 'day',
+                                               end=game2.date),
+                         [('2010-09-30', 1)])
+        with self.assertRaises(ValueError):
+            db.count_player_games(pupkin, 'week')
+
+        # The games of a player are read from the covering indices only.
+        plan = ' '.join(str(row) for row in db._conn.execute(
+            """EXPLAIN QUERY PLAN
+               SELECT date, playerid2, result FROM game
+               WHERE playerid1=? AND date >= ? AND date < ?""", (1, 0, 1)))
+        self.assertIn('COVERING INDEX game_player1_date', plan)
+
+    def test_shards(self):
+        def game(date, moves, result=1):
+            return Game(result=result,
+                        player1_name='Pupkin, Vasily',
+                        player2_name='Syutkin, Vladimir',
+                        date=date,
+                        moves=moves,
+                        tags={'Event': date})
+
+        def count(db, schema):
+            return db._conn.execute(
+                'SELECT count(*) FROM %s.game' % schema).fetchone()[0]
+
+        start, _ = _parse_date('2010.01.01')
+        end, _ = _parse_date('2011.01.01')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'games.db')
+            db = DataBase(path=path)
+            game1 = game('2009.05.01', ['e4', 'e5'])
+            game2 = game('2010.05.01', ['d4', 'd5'])
+            db.add_games([game1, game2])
+            db.build_opening_tree()
+
+            db.add_shard('2010.db', start, end)
+            self.assertTrue(os.path.exists(os.path.join(tmpdir, '2010.db')))
+            with self.assertRaises(ValueError):
+                db.add_shard('other.db', end - 1, end + 1)
+            self.assertEqual(count(db, 'main'), 1)
+            self.assertEqual(count(db, 'shard1'), 1)
+            self.assertEqual(db.load_game(game2.gameid).tags['Event'],
+                             '2010.05.01')
+
+            # The new games go to the shard of their date.
+            game3 = game('2010.06.01', ['c4', 'e5'])
+            game4 = game('2011.06.01', ['e4', 'c5'])
+            game5 = game('2010.07.01', ['e4', 'e5', 'Nf3'])
+            db.add_game(game3)
+            db.add_games([game4, game5])
+            db.commit()
+            self.assertEqual(count(db, 'shard1'), 3)
+            self.assertGreaterEqual(game3.gameid, 1 << 40)
+            self.assertEqual(db.find_game(game('2010.06.01', ['c4', 'e5'])),
+                             game3.gameid)
+            self.assertEqual(db.count_games_with_prefix(['e4']), 3)
+            self.assertEqual(db.count_games_with_prefix(['e4', 'e5']), 2)
+            db.close()
+
+            db = DataBase(path=path)
+            self.assertEqual(len(db.load_game_results()), 5)
+            self.assertEqual(
+                sorted(row[2] for row in db.load_game_results(start=start,
+                                                              end=end)),
+                [game2.date // (24 * 3600), game3.date // (24 * 3600),
+                 game5.date // (24 * 3600)])
+            self.assertNotIn('shard1', db._games_in(end, None))
+            self.assertEqual(len(db.load_game_results(
+                where=tag_filter('Event', like='2010%'))), 3)
+            self.assertEqual(len(db.player_games(game1.player1_id)), 5)
+            self.assertEqual(
+                [g.gameid for g in db.load_games([game3.gameid,
+                                                  game1.gameid])],
+                [game3.gameid, game1.gameid])
+
+            db.delete_games([game2.gameid])
+            self.assertIsNone(db.load_game(game2.gameid))
+            self.assertEqual(count(db, 'shard1'), 2)
+            db.commit()
+
+            pool = DataBasePool(path)
+            with pool.reader() as reader:
+                self.assertEqual(reader.load_game(game3.gameid).moves,
+                                 ['c4', 'e5'])
+            pool.close()
+            db.close()
+
+    def test_ratings(self):
+        db = DataBase(path=':memory:')
+        day = 24 * 3600
+        ratings = {1: {100: 2000.0, 110: 2100.0, 120: 2050.0},
+                   2: {105: 2200.0},
+                   3: {90: 1800.0, 130: 2300.0}}
+        runid = db.save_ratings(ratings, description='test')
+        other_runid = db.save_ratings({1: {100: 1000.0}})
+        self.assertEqual([run[::2] for run in db.rating_runs()],
+                         [(runid, 'test'), (other_runid, '')])
+        self.assertEqual(db.load_ratings(runid), ratings)
+
+        self.assertIsNone(db.rating_on(runid, 1, 99 * day))
+        self.assertEqual(db.rating_on(runid, 1, 100 * day), 2000)
+        self.assertAlmostEqual(db.rating_on(runid, 1, 105 * day), 2050)
+        self.assertAlmostEqual(db.rating_on(runid, 1, 117 * day + day // 2),
+                               2062.5)
+        self.assertEqual(db.rating_on(runid, 1, 1000 * day), 2050)
+        self.assertEqual(db.rating_on(other_runid, 1, 105 * day), 1000)
+        self.assertIsNone(db.rating_on(runid, 4, 105 * day))
+
+        top = db.top_ratings(runid, 110 * day, n=2)
+        self.assertEqual([playerid for playerid, _ in top], [2, 1])
+        self.assertAlmostEqual(top[1][1], 2100)
+        self.assertEqual([playerid for playerid, _ in
+                          db.top_ratings(runid, 130 * day)], [3, 2, 1])
+        self.assertEqual([playerid for playerid, _ in
+                          db.top_ratings(runid, 112 * day,
+                                         max_inactive=5 * day)], [1])
+
+    def test_load_game_result_columns(self):
+        db = DataBase(path=':memory:')
+        players = ['Pupkin, Vasily', 'Syutkin, Vladimir', 'Ivanov, Ivan']
+        for i in range(7):
+            db.add_game(Game(result=i % 3,
+                             player1_name=players[i % 3],
+                             player2_name=players[(i + 1) % 3],
+                             date='2010-09-%02d' % (i + 1),
+                             moves=['e4', str(i)]))
+        db.add_game(Game(result=1,
+                         player1_name=players[0],
+                         player2_name=players[1],
+                         date='????-??-??',
+                         moves=['d4']))
+
+        columns = db.load_game_result_columns(chunk_size=3)
+        self.assertEqual([column.dtype for column in columns],
+                         [np.int32, np.int32, np.int32, np.int8])
+        self.assertEqual(list(zip(*(column.tolist() for column in columns))),
+                         db.load_game_results())
+        self.assertEqual(len(db.load_game_result_columns(
+            start=_parse_date('2010-09-03')[0]).day), 5)
+
+        # Ivanov plays 4 games, the others 5, but only 3 without Ivanov.
+        self.assertEqual(len(db.load_game_result_columns(mingames=4).day), 7)
+        self.assertEqual(len(db.load_game_result_columns(mingames=5).day), 0)
+        self.assertEqual(len(db.load_game_results(mingames=4)), 7)
+        self.assertEqual(db.load_game_results(mingames=5), [])
+        # Pupkin plays 4 of these games, the others 3.
+        start = _parse_date('2010-09-03')[0]
+        self.assertEqual(len(db.load_game_result_columns(
+            mingames=3, start=start).day), 5)
+        self.assertEqual(len(db.load_game_result_columns(
+            mingames=4, start=start).day), 0)
+
+    def test_load_game_results_where(self):
+        db = DataBase(path=':memory:')
+        players = ['Pupkin, Vasily', 'Syutkin, Vladimir', 'Ivanov, Ivan']
+        for i in range(6):
+            db.add_game(Game(result=1,
+                             player1_name=players[i % 3],
+                             player2_name=players[(i + 1) % 3],
+                             date='2010-09-%02d' % (i + 1),
+                             moves=['e4', str(i)],
+                             tags={'Event': 'Blitz' if i < 4 else 'Open',
+                                   'TimeControl': str(i % 2)}))
+
+        def days(where):
+            return sorted(row[2] - 14853
+                          for row in db.load_game_results(where=where))
+
+        self.assertEqual(days(tag_filter('Event', 'Blitz')), [0, 1, 2, 3])
+        self.assertEqual(days(tag_filter('Event', ['Open', 'Rapid'])), [4, 5])
+        self.assertEqual(days(tag_filter('Event', like='b%')), [0, 1, 2, 3])
+        self.assertEqual(days(tag_filter('Round')), [])
+        self.assertEqual(days(tag_filter('Unknown', 'x')), [])
+        blitz = tag_filter('Event', 'Blitz')
+        even = tag_filter('TimeControl', '0')
+        self.assertEqual(days(blitz & ~even), [1, 3])
+        self.assertEqual(days(~blitz | ~even), [1, 3, 4, 5])
+        self.assertEqual(
+            days(date_filter(_parse_date('2010-09-03')[0],
+                             _parse_date('2010-09-05')[0])),
+            [2, 3])
+        ivanov = db.get_player(players[2])
+        self.assertEqual(days(player_filter([ivanov])), [1, 2, 4, 5])
+        columns = db.load_game_result_columns(
+            where=player_filter([ivanov]) & tag_filter('Event', 'Blitz'))
+        self.assertEqual(sorted(columns.day - 14853), [1, 2])
+
     def test_dates_compatible(self):
         date1, precision1 = _parse_date('????-??-??')
         self.assertTrue(_dates_compatible(date1, precision1, date1, precision1))
@@ -227,6 +810,61 @@ class TestGamesDB(unittest.TestCase):
                                       'Assange, Julian'))
 
 
+
+class TestDataBasePool(unittest.TestCase):
+
+    def test_readers(self):
+        def game(moves):
+            return Game(result=1,
+                        player1_name='Pupkin, Vasily',
+                        player2_name='Syutkin, Vladimir',
+                        date='2010-09-30',
+                        moves=moves)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'games.db')
+            db = DataBase(path=path, wal=True, packed_moves=True)
+            self.assertEqual(
+                db._conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            id1 = db.add_game(game(['e4', 'e5']))
+            db.commit()
+
+            pool = DataBasePool(path, size=2)
+            with pool.reader() as reader:
+                # Not committed yet.
+                id2 = db.add_game(game(['d4', 'd5']))
+                self.assertIsNone(reader.load_game(id2))
+                # The writer isn't blocked by the reader, but the reader
+                # keeps its snapshot until the end of the block.
+                db.commit()
+                self.assertIsNone(reader.load_game(id2))
+                self.assertEqual(reader.load_game(id1).moves, ['e4', 'e5'])
+                with self.assertRaises(sqlite3.OperationalError):
+                    reader.delete_games([id1])
+
+            # The new moves are read from the vocabulary.
+            with pool.reader() as reader:
+                self.assertEqual(reader.load_game(id2).moves, ['d4', 'd5'])
+
+            def load(gameid):
+                with pool.reader() as reader:
+                    return reader.load_game(gameid).moves
+
+            with concurrent.futures.ThreadPoolExecutor(4) as executor:
+                self.assertEqual(list(executor.map(load, [id1, id2] * 4)),
+                                 [['e4', 'e5'], ['d4', 'd5']] * 4)
+            self.assertLessEqual(len(pool._databases), 2)
+
+            pool.close()
+            db.close()
+
+            # The journal mode is kept in the file.
+            db = DataBase(path=path)
+            self.assertEqual(
+                db._conn.execute('PRAGMA synchronous').fetchone()[0], 1)
+            db.close()
+
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,120 @@
+import io
+import os.path
+import tempfile
+import unittest
+
+from game import StreamPGNParser, open_pgn
+from gamesdb import DataBase, DuplicateGameError
+from import_pgn import Progress, file_fingerprint, import_file
+
+
+TEST_FILE = os.path.join(os.path.dirname(__file__), '365chess',
+                         'Manuel_Leon_Hoyos.pgn')
+
+
+def _count_games(db):
+    return db._conn.execute('SELECT count(*) FROM game').fetchone()[0]
+
+
+class TestImportFile(unittest.TestCase):
+
+    def test_same_as_add_game(self):
+        expected_db = DataBase(path=':memory:')
+        expected_errors = 0
+        with open_pgn(TEST_FILE) as pgn_file:
+            for game in StreamPGNParser(pgn_file).parse():
+                try:
+                    expected_db.add_game(game)
+                except DuplicateGameError:
+                    expected_errors += 1
+
+        db = DataBase(path=':memory:')
+        progress = Progress(out=io.StringIO())
+        errors = import_file(db, TEST_FILE, progress=progress)
+        self.assertEqual(len(errors), expected_errors)
+        self.assertEqual(_count_games(db), _count_games(expected_db))
+        self.assertIsNotNone(progress.rate('parse'))
+        self.assertIsNotNone(progress.rate('lookup'))
+
+        # A copy of the file is not skipped, its games are only found.
+        with tempfile.TemporaryDirectory() as tmpdir:
+            copy = os.path.join(tmpdir, 'copy.pgn')
+            with open(TEST_FILE, 'rb') as src, open(copy, 'wb') as dst:
+                dst.write(src.read() + b'\n')
+            import_file(db, copy, progress=progress)
+        self.assertEqual(_count_games(db), _count_games(expected_db))
+
+    def test_resume(self):
+        class FailingDataBase(DataBase):
+            def insert_games(self, games):
+                if _count_games(self) >= 300:
+                    raise RuntimeError('Crash')
+                super().insert_games(games)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'games.db')
+            db = FailingDataBase(path=path)
+            with self.assertRaises(RuntimeError):
+                import_file(db, TEST_FILE, checkpoint_games=100,
+                            progress=Progress(out=io.StringIO()))
+            db._conn.close()
+
+            db = DataBase(path=path)
+            fingerprint = file_fingerprint(TEST_FILE)
+            position, ngames, complete = db.get_checkpoint(fingerprint)
+            self.assertFalse(complete)
+            self.assertGreater(position, 0)
+            self.assertGreaterEqual(ngames, 300)
+            self.assertGreaterEqual(_count_games(db), 300)
+
+            out = io.StringIO()
+            import_file(db, TEST_FILE, progress=Progress(out=out))
+            self.assertIn('Resuming after %d games' % ngames, out.getvalue())
+            count = _count_games(db)
+            expected_db = DataBase(path=':memory:')
+            import_file(expected_db, TEST_FILE,
+                        progress=Progress(out=io.StringIO()))
+            self.assertEqual(count, _count_games(expected_db))
+            self.assertEqual(db.get_checkpoint(fingerprint)[1:],
+                             expected_db.get_checkpoint(fingerprint)[1:])
+            self.assertLess(ngames, expected_db.get_checkpoint(fingerprint)[1])
+
+            out = io.StringIO()
+            self.assertEqual(import_file(db, TEST_FILE,
+                                         progress=Progress(out=out)), [])
+            self.assertIn('Already imported', out.getvalue())
+            self.assertEqual(_count_games(db), count)
+            db._conn.close()
+
+    def test_missing_file(self):
+        db = DataBase(path=':memory:')
+        with self.assertRaises(FileNotFoundError):
+            import_file(db, TEST_FILE + '.missing',
+                        progress=Progress(out=io.StringIO()))
+
+
+class TestProgress(unittest.TestCase):
+
+    def test_report(self):
+        out = io.StringIO()
+        progress = Progress(interval=3600, out=out)
+        progress.add('read', 1 << 20, 0.5)
+        progress.add('parse', 100, 0.1)
+        progress.add('lookup', 100, 0.2)
+        self.assertIsNone(progress.rate('write'))
+        self.assertEqual(progress.rate('parse'), 1000)
+
+        progress.report()
+        self.assertEqual(out.getvalue(), '')
+
+        progress.report(force=True)
+        line = out.getvalue()
+        self.assertIn('100 games', line)
+        self.assertIn('read 2.0 MB/s', line)
+        self.assertIn('parse 1000 games/s', line)
+        self.assertIn('lookup 500 games/s', line)
+        self.assertNotIn('write', line)
+
+
+if __name__ == '__main__':
+    unittest.main()
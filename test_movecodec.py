@@ -0,0 +1,46 @@
+import unittest
+
+from movecodec import (MoveCodec, decode_varints, encode_varints,
+                       encode_varints_many)
+
+
+class TestVarints(unittest.TestCase):
+
+    def test_encode_decode(self):
+        values = [0, 1, 127, 128, 300, 16383, 16384, 1 << 40]
+        data = encode_varints(values)
+        self.assertEqual(data[:4], b'\x00\x01\x7f\x80')
+        self.assertEqual(len(data), 1 + 1 + 1 + 2 + 2 + 2 + 3 + 6)
+        self.assertEqual(decode_varints(data).tolist(), values)
+        self.assertEqual(encode_varints([]), b'')
+        self.assertEqual(decode_varints(b'').tolist(), [])
+
+    def test_encode_many(self):
+        sequences = [[1, 300], [], [128], [], [5]]
+        self.assertEqual(encode_varints_many(sequences),
+                         [encode_varints(values) for values in sequences])
+        self.assertEqual(encode_varints_many([]), [])
+
+
+class TestMoveCodec(unittest.TestCase):
+
+    def test_codec(self):
+        codec = MoveCodec(['e4', 'e5'])
+        self.assertEqual(codec.add_moves(['e5', 'Nf3', 'Nf3']), ['Nf3'])
+        self.assertEqual(len(codec), 3)
+        moves = ['e4', 'e5', 'Nf3']
+        self.assertEqual(codec.encode(moves), b'\x00\x01\x02')
+        self.assertEqual(codec.decode(codec.encode(moves)), moves)
+        self.assertIsNone(codec.encode(['e4', 'Nc6']))
+
+        codec.add_moves('m%d' % i for i in range(200))
+        moves = ['m199', 'e4', 'm0']
+        self.assertEqual(len(codec.encode(moves)), 4)
+        self.assertEqual(codec.decode(codec.encode(moves)), moves)
+        self.assertEqual(codec.encode_many([moves, [], ['e5']]),
+                         [codec.encode(moves), b'', b'\x01'])
+        self.assertEqual(codec.decode(b''), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
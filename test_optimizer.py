@@ -2,6 +2,7 @@ import numpy as np
 import unittest
 
 from math import log
+from gamesdb import GameResults
 from optimizer import Optimizer, LogisticProbabilityFunction, convert_rating_diff
 
 GAMES1 = [(1, 2, 1, 1),
@@ -84,6 +85,39 @@ class TestOptimizer(unittest.TestCase):
         o.load_games(GAMES1)
         self.assertEqual(o.nrating_vars_, 9)
 
+    def test_rating_vars(self):
+        o = Optimizer(time_delta=1.0)
+        o.load_games(GAMES1)
+        # Players by their first games, sorted by result.
+        self.assertEqual(o.var_player_date_,
+                         [(3, 1), (3, 2), (3, 3), (3, 4), (2, 1), (2, 3),
+                          (2, 4), (1, 1), (1, 2)])
+        self.assertEqual(o.games_player1_var_.tolist(), [2, 7, 4, 3, 8])
+        self.assertEqual(o.games_player2_var_.tolist(), [5, 4, 0, 6, 1])
+        self.assertEqual(o.time_delta_vector_.tolist(),
+                         [1, 1, 1, 0, 1, 1, 0, 1])
+        m = o.grad_by_game_m_.toarray()
+        self.assertEqual(m.shape, (9, 5))
+        self.assertEqual(m[:, 0].tolist(), [0, 0, 1, 0, 0, -1, 0, 0, 0])
+        self.assertEqual(np.abs(m).sum(), 10)
+
+        o.load_games([(1, 1, 1, 1)])
+        self.assertEqual(o.grad_by_game_m_.toarray().tolist(), [[-1]])
+
+    def test_load_columns(self):
+        o1 = Optimizer()
+        o1.load_games(GAMES1)
+        o2 = Optimizer()
+        o2.load_games(GameResults(*(np.array(column)
+                                    for column in zip(*GAMES1))))
+        self.assertEqual(o1.var_player_date_, o2.var_player_date_)
+        self.assertTrue((o1.games_player1_var_ ==
+                         o2.games_player1_var_).all())
+        self.assertTrue((o1.games_player2_var_ ==
+                         o2.games_player2_var_).all())
+        self.assertEqual(o1.wins_slice_, o2.wins_slice_)
+        self.assertEqual(o1.draws_slice_, o2.draws_slice_)
+
     def test_output_format(self):
         o = Optimizer()
         o.load_games(GAMES1)
@@ -247,6 +281,21 @@ class TestOptimizer(unittest.TestCase):
                 return res
             self.assertAlmostEqual(derivative(ocomp, v[i]), grad[i])
 
+    def test_objective_and_gradient(self):
+        o = Optimizer(rand_seed=239, time_delta=0.01)
+        o.load_games(GAMES1)
+        v = o.init()
+
+        value, grad = o.objective_and_gradient(v)
+        self.assertAlmostEqual(value, o.objective(v))
+        np.testing.assert_allclose(grad, o.gradient(v), rtol=1E-9)
+
+        calls = o.objective_calls
+        self.assertIs(o.objective_and_gradient(v.copy())[1], grad)
+        self.assertEqual(o.objective_calls, calls)
+        v[0] += 0.1
+        self.assertAlmostEqual(o.objective_and_gradient(v)[0], o.objective(v))
+
     def test_games1(self):
         o = Optimizer(rand_seed=239)
         o.load_games(GAMES1)
@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from game import Game
+from gamesdb import DataBase
+from resultcache import ResultCache
+
+PLAYERS = ['Pupkin, Vasily', 'Syutkin, Vladimir', 'Ivanov, Ivan']
+
+
+def _rows(columns):
+    return sorted(zip(*(column.tolist() for column in columns)))
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db = DataBase(os.path.join(self.directory, 'games.db'))
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.directory)
+
+    def add_games(self, n, day=1):
+        gameids = []
+        for i in range(n):
+            gameids.append(self.db.add_game(Game(
+                result=i % 3,
+                player1_name=PLAYERS[i % 3],
+                player2_name=PLAYERS[(i + 1) % 3],
+                date='2010-09-%02d' % (day + i),
+                moves=['e4', str(day + i)])))
+        self.db.commit()
+        return gameids
+
+    def test_load(self):
+        with self.assertRaises(ValueError):
+            ResultCache(DataBase(':memory:'))
+
+        cache = ResultCache(self.db)
+        self.assertEqual(len(cache.load().day), 0)
+
+        gameids = self.add_games(5)
+        columns = cache.load()
+        self.assertEqual(_rows(columns),
+                         _rows(self.db.load_game_result_columns()))
+        self.assertEqual(columns.result.dtype,
+                         self.db.load_game_result_columns().result.dtype)
+        token_files = sorted(os.listdir(cache._directory))
+        self.assertEqual(_rows(cache.load()), _rows(columns))
+        self.assertEqual(sorted(os.listdir(cache._directory)), token_files)
+
+        # New games are appended to the same files.
+        self.add_games(3, day=10)
+        columns = cache.load()
+        self.assertEqual(sorted(os.listdir(cache._directory)), token_files)
+        self.assertEqual(_rows(columns),
+                         _rows(self.db.load_game_result_columns()))
+        self.assertEqual(len(cache.load(mingames=3).day),
+                         len(self.db.load_game_result_columns(mingames=3).day))
+
+        # A deletion rebuilds the cache in new files.
+        self.db.delete_games(gameids[:2])
+        self.db.commit()
+        columns = cache.load()
+        self.assertNotEqual(sorted(os.listdir(cache._directory)), token_files)
+        self.assertEqual(len(os.listdir(cache._directory)), len(token_files))
+        self.assertEqual(_rows(columns),
+                         _rows(self.db.load_game_result_columns()))
+
+
+if __name__ == '__main__':
+    unittest.main()